@@ -1,38 +1,84 @@
 import streamlit as st
-import yfinance as yf
+import price_store
 import plotly.graph_objects as go
 import pandas as pd
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from datetime import datetime, timedelta
 
+TICKERS = ['^IRX', '^FVX', '^TNX', '^TYX']  # 3-month, 5-year, 10-year, 30-year yields
+MATURITIES = np.array([0.25, 5, 10, 30])  # years
+MATURITY_LABELS = ['3M', '5Y', '10Y', '30Y']
+LAMBDA_GRID = np.linspace(0.5, 10, 96)  # Nelson-Siegel decay candidates (years)
+CURVE_GRID = np.linspace(0.25, 30, 120)  # maturities of the smooth curve (years)
+SPREADS = {'10Y-3M': ('^TNX', '^IRX'), '30Y-5Y': ('^TYX', '^FVX')}
+HISTORY_START = {'10年': 10, '20年': 20, '全部': 60}  # years of history for the spread analytics
+MAX_POINTS = 2000  # points per trace sent to the browser
+
 # Function to fetch yield data from Yahoo Finance
+# Keyed by date strings so reruns within the store's refresh interval hit the cache
+@st.cache_data(ttl=price_store.REFRESH_INTERVAL)
 def fetch_yield_data(start_date, end_date):
-    tickers = ['^IRX', '^FVX', '^TNX', '^TYX']  # 3-month, 5-year, 10-year, 30-year yields
-    yields = yf.download(tickers, start=start_date, end=end_date)['Adj Close']
+    yields, _ = price_store.load_prices(TICKERS, start=start_date, end=end_date)
     desired_order = ['^IRX', '^FVX', '^TNX', '^TYX']
-    return yields[desired_order]
+    return yields[desired_order].ffill().dropna()
+
+def ns_loadings(tau, lam):
+    """
+    Nelson-Siegel level, slope and curvature loadings of maturities tau for
+    decay lam, broadcast over both; the loadings are the last axis.
+    """
+    x = tau / lam
+    slope = (1 - np.exp(-x)) / x
+    return np.stack([np.ones_like(slope), slope, slope - np.exp(-x)], axis=-1)
+
+@st.cache_data
+def fit_nelson_siegel(yields):
+    """
+    Fit a Nelson-Siegel curve to every date at once. For each candidate decay
+    the betas of all dates come from one least-squares solve; each date then
+    keeps the decay with the smallest squared error. Returns the per-date
+    parameters and the date x CURVE_GRID matrix of fitted curves.
+    """
+    observed = yields.to_numpy(dtype=float)
+    design = ns_loadings(MATURITIES[None, :], LAMBDA_GRID[:, None])  # lambda x maturity x beta
+    betas = np.einsum('kbm,tm->ktb', np.linalg.pinv(design), observed)  # lambda x date x beta
+    errors = ((np.einsum('kmb,ktb->ktm', design, betas) - observed) ** 2).sum(axis=2)
+
+    best = errors.argmin(axis=0)
+    dates = np.arange(len(observed))
+    best_betas = betas[best, dates]
+    curves = np.einsum('tgb,tb->tg', ns_loadings(CURVE_GRID[None, :], LAMBDA_GRID[best][:, None]), best_betas)
+    params = pd.DataFrame(np.column_stack([best_betas, LAMBDA_GRID[best], np.sqrt(errors[best, dates] / len(MATURITIES))]),
+                          index=yields.index, columns=['β0 (水準)', 'β1 (斜率)', 'β2 (曲度)', 'λ', 'RMSE'])
+    return params, curves
 
 # Function to create the yield curve plot
-def create_yield_curve_plot(yields, days_ago):
-    maturities = ['3M', '5Y', '10Y', '30Y']
+def create_yield_curve_plot(yields, curves, days_ago):
     current_yields = yields.iloc[-1].values
-    yields_n_days_ago = yields.iloc[-days_ago-1].values if len(yields) > days_ago else yields.iloc[0].values
+    past = -days_ago-1 if len(yields) > days_ago else 0
+    yields_n_days_ago = yields.iloc[past].values
 
     fig = go.Figure()
 
-    # Plot for today's yields
-    fig.add_trace(go.Scatter(x=maturities, y=current_yields, mode='lines+markers', name='Today',
-                             line=dict(color='blue', width=2), marker=dict(size=8)))
+    # Plot for today's yields: observed points and the fitted curve
+    fig.add_trace(go.Scatter(x=CURVE_GRID, y=curves[-1], mode='lines', name='Today',
+                             line=dict(color='blue', width=2)))
+    fig.add_trace(go.Scatter(x=MATURITIES, y=current_yields, mode='markers', name='Today',
+                             marker=dict(color='blue', size=8), showlegend=False))
     
     # Plot for yields 'days_ago' days ago
-    fig.add_trace(go.Scatter(x=maturities, y=yields_n_days_ago, mode='lines+markers', name=f'{days_ago} Days Ago',
-                             line=dict(color='orange', width=2, dash='dash'), marker=dict(size=8)))
+    fig.add_trace(go.Scatter(x=CURVE_GRID, y=curves[past], mode='lines', name=f'{days_ago} Days Ago',
+                             line=dict(color='orange', width=2, dash='dash')))
+    fig.add_trace(go.Scatter(x=MATURITIES, y=yields_n_days_ago, mode='markers', name=f'{days_ago} Days Ago',
+                             marker=dict(color='orange', size=8), showlegend=False))
 
     # Update layout: x-axis labels, y-axis starting from 0
     fig.update_layout(
         title=f'美債殖利率: 今天 vs {days_ago} 交易日前',
         xaxis_title='年期',
         yaxis_title='殖利率 (%)',
-        xaxis=dict(type='category'),
+        xaxis=dict(tickvals=MATURITIES, ticktext=MATURITY_LABELS),
         yaxis=dict(range=[0, None]),  # Start y-axis from 0
         legend=dict(
             x=0.75,
@@ -47,6 +93,134 @@ def create_yield_curve_plot(yields, days_ago):
 
     return fig
 
+@st.cache_data
+def create_curve_animation(yields, curves, step=5):
+    """
+    Animate the fitted curve over the history, one frame every `step`
+    trading days ending on the latest date. Built once per data update.
+    """
+    positions = np.arange(len(yields) - 1, -1, -step)[::-1]
+    labels = yields.index[positions].strftime('%Y-%m-%d')
+
+    def traces(position):
+        return [go.Scatter(x=CURVE_GRID, y=curves[position], mode='lines', line=dict(color='blue', width=2)),
+                go.Scatter(x=MATURITIES, y=yields.iloc[position].values, mode='markers', marker=dict(color='blue', size=8))]
+
+    frames = [go.Frame(data=traces(position), name=label) for position, label in zip(positions, labels)]
+    fig = go.Figure(data=traces(positions[-1]), frames=frames)
+    fig.update_layout(
+        title='殖利率曲線演變',
+        xaxis_title='年期',
+        yaxis_title='殖利率 (%)',
+        xaxis=dict(tickvals=MATURITIES, ticktext=MATURITY_LABELS),
+        yaxis=dict(range=[0, np.nanmax(curves) * 1.05]),
+        showlegend=False,
+        updatemenus=[dict(type='buttons', x=0, y=-0.15, xanchor='left', buttons=[
+            dict(label='▶', method='animate', args=[None, dict(frame=dict(duration=80, redraw=False), fromcurrent=True)]),
+            dict(label='❚❚', method='animate', args=[[None], dict(mode='immediate', frame=dict(duration=0))]),
+        ])],
+        sliders=[dict(active=len(frames) - 1, x=0.1, len=0.9, y=-0.05, currentvalue=dict(prefix='日期: '), steps=[
+            dict(label=label, method='animate', args=[[label], dict(mode='immediate', frame=dict(duration=0, redraw=False))])
+            for label in labels
+        ])],
+        width=800,
+        height=550
+    )
+    return fig
+
+def rolling_stats(values, window):
+    """
+    Rolling z-score and percentile rank (share of the window at or below the
+    latest value) of a 1-D array, computed over a sliding window view.
+    The first window - 1 entries are NaN.
+    """
+    z_score = np.full(len(values), np.nan)
+    percentile = np.full(len(values), np.nan)
+    if len(values) >= window:
+        windows = sliding_window_view(values, window)
+        mean = windows.mean(axis=1)
+        std = windows.std(axis=1, ddof=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z_score[window - 1:] = (values[window - 1:] - mean) / std
+        percentile[window - 1:] = (windows <= values[window - 1:, None]).mean(axis=1)
+    return z_score, percentile
+
+def inversion_episodes(spread):
+    """
+    Return the runs of consecutive days with a negative spread: start, end,
+    calendar days, trading days and the deepest spread of each run.
+    """
+    inverted = spread.to_numpy() < 0
+    if not inverted.any():
+        return pd.DataFrame(columns=['開始', '結束', '天數', '交易日數', '最深利差'])
+    starts = np.flatnonzero(inverted & ~np.r_[False, inverted[:-1]])
+    ends = np.flatnonzero(inverted & ~np.r_[inverted[1:], False])
+    dates = spread.index
+    return pd.DataFrame({
+        '開始': dates[starts].date,
+        '結束': dates[ends].date,
+        '天數': (dates[ends] - dates[starts]).days + 1,
+        '交易日數': ends - starts + 1,
+        # Days between runs are masked out, so each segment's minimum is its run's
+        '最深利差': np.minimum.reduceat(np.where(inverted, spread.to_numpy(), np.inf), starts),
+    })
+
+@st.cache_data
+def spread_analytics(yields, window):
+    """
+    Precompute the spreads, their rolling z-scores and percentiles, and the
+    inversion episodes of every spread over the whole history.
+    """
+    spreads = pd.DataFrame({name: yields[long] - yields[short] for name, (long, short) in SPREADS.items()})
+    stats = {}
+    for name in spreads.columns:
+        z_score, percentile = rolling_stats(spreads[name].to_numpy(), window)
+        stats[name] = pd.DataFrame({'z-score': z_score, '百分位': percentile}, index=spreads.index)
+    episodes = {name: inversion_episodes(spreads[name]) for name in spreads.columns}
+    return spreads, stats, episodes
+
+def downsample(series, max_points=MAX_POINTS):
+    """
+    Reduce a series to about max_points points by keeping the minimum and
+    maximum of each bucket, so spikes and troughs survive.
+    """
+    if len(series) <= max_points:
+        return series
+    values = series.to_numpy(dtype=float)
+    buckets = max_points // 2
+    size = -(-len(values) // buckets)
+    padded = np.pad(values, (0, buckets * size - len(values)), constant_values=np.nan).reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    filled = ~np.isnan(padded).all(axis=1)
+    lows = np.nanargmin(np.where(filled[:, None], padded, 0), axis=1) + offsets
+    highs = np.nanargmax(np.where(filled[:, None], padded, 0), axis=1) + offsets
+    keep = np.unique(np.r_[lows[filled], highs[filled], len(values) - 1])
+    return series.iloc[keep]
+
+def create_spread_plot(spreads, episodes):
+    fig = go.Figure()
+    for name in spreads.columns:
+        series = downsample(spreads[name].dropna())
+        fig.add_trace(go.Scatter(x=series.index, y=series.values, mode='lines', name=name))
+    # Shade the 10Y-3M inversions, the classic recession signal
+    for row in episodes['10Y-3M'].itertuples(index=False):
+        fig.add_vrect(x0=row[0], x1=row[1], fillcolor='red', opacity=0.12, line_width=0)
+    fig.add_hline(y=0, line_color='gray', line_dash='dot')
+    fig.update_layout(title='殖利率利差 (紅色區間: 10Y-3M 倒掛)', yaxis_title='利差 (%)', hovermode='x unified',
+                      width=800, height=450)
+    return fig
+
+def create_zscore_plot(stats, window):
+    fig = go.Figure()
+    for name, frame in stats.items():
+        series = downsample(frame['z-score'].dropna())
+        fig.add_trace(go.Scatter(x=series.index, y=series.values, mode='lines', name=name))
+    for level in (-2, 2):
+        fig.add_hline(y=level, line_color='gray', line_dash='dot')
+    fig.update_layout(title=f'利差 z-score ({window} 交易日滾動)', yaxis_title='z-score', hovermode='x unified',
+                      width=800, height=400)
+    return fig
+
 # Streamlit app starts here
 st.title('美債殖利率變動')
 
@@ -55,21 +229,50 @@ end_date = datetime.now()
 start_date = end_date - timedelta(days=365*3)
 
 # Fetch the yield data
-yields = fetch_yield_data(start_date, end_date)
-
-# Calculate the difference in days between the first and last date
-days_difference = (yields.index[-1] - yields.index[0]).days
-
-# Number of days ago selection, with the maximum value capped by the data range
-days_ago = st.slider("距今日之交易日數", min_value=1, max_value=min(days_difference, 750), value=1)
+yields = fetch_yield_data(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
 
 # Create and display the yield curve plot
 if not yields.empty:
-    fig = create_yield_curve_plot(yields, days_ago)
+    # Calculate the difference in days between the first and last date
+    days_difference = (yields.index[-1] - yields.index[0]).days
+
+    # Number of days ago selection, with the maximum value capped by the data range
+    days_ago = st.slider("距今日之交易日數", min_value=1, max_value=min(days_difference, 750), value=1)
+
+    # Fitted once per data update; moving the slider only slices these arrays
+    params, curves = fit_nelson_siegel(yields)
+    fig = create_yield_curve_plot(yields, curves, days_ago)
     st.plotly_chart(fig)
+
+    st.plotly_chart(create_curve_animation(yields, curves))
     
     # Display the yield data with reversed index
     st.subheader("殖利率 (倒序)")
-    st.dataframe(yields.iloc[::-1])  # Reverse the index of the DataFrame
+    st.dataframe(yields.join(params.round(3)).iloc[::-1])  # Reverse the index of the DataFrame
 else:
     st.error("無資料.")
+
+# Spread analytics over a long history, precomputed once per data update
+st.subheader("利差與倒掛分析")
+col1, col2 = st.columns(2)
+history = col1.selectbox("資料期間", list(HISTORY_START), index=1)
+window = col2.select_slider("滾動視窗 (交易日)", options=[63, 126, 252, 504, 1260], value=252)
+history_start = end_date - timedelta(days=365*HISTORY_START[history])
+history_yields = fetch_yield_data(history_start.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+
+if len(history_yields) > window:
+    spreads, stats, episodes = spread_analytics(history_yields, window)
+
+    columns = st.columns(len(spreads.columns))
+    for column, name in zip(columns, spreads.columns):
+        latest = stats[name].iloc[-1]
+        column.metric(f"{name} 利差", f"{spreads[name].iloc[-1]:.2f}%",
+                      f"z {latest['z-score']:+.2f} / 百分位 {latest['百分位']:.0%}", delta_color='off')
+
+    st.plotly_chart(create_spread_plot(spreads, episodes))
+    st.plotly_chart(create_zscore_plot(stats, window))
+
+    name = st.radio("倒掛區間", list(SPREADS), horizontal=True)
+    st.dataframe(episodes[name].iloc[::-1].round(3))
+else:
+    st.info("資料不足以計算滾動統計.")
@@ -0,0 +1,24 @@
+"""
+Atomic replacement of cache files shared by the apps in this repo.
+
+A cache file is written to a temporary name next to it and then moved over
+it, so a session reading the cache never sees a half-written file and a
+crash never leaves one behind.
+"""
+import os
+import threading
+
+def write(path, write_to):
+    """
+    Call write_to(tmp_path) and move the result to path. The temporary name
+    is unique per process and thread, since Streamlit sessions are threads of
+    one process.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write_to(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
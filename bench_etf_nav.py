@@ -0,0 +1,138 @@
+"""
+Microbenchmark of etf_nav.load_data's table parsing against the per-column
+parser it replaced, on synthetic disclosure tables.
+
+    python bench_etf_nav.py [rows ...]
+
+Both parsers get the same raw tables through load_data('api') with the feeds
+replaced, and their outputs are compared before the timings are printed.
+"""
+import re
+import sys
+import time
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import etf_nav
+
+N_ETFS = 300
+PLACEHOLDER_RATE = 0.02
+REPEAT = 3
+
+def synthetic_table(rows, seed, unique=False):
+    """
+    Raw table in the layout scrape_etf_data returns: strings with thousands
+    separators, '%' premiums and the pages' placeholders. Rows are snapshots
+    of N_ETFS ETFs, where units, their daily change and the previous NAV are
+    fixed per ETF and prices move on a 0.05 tick; unique=True draws every
+    value per row instead, the worst case for parsing distinct strings once.
+    """
+    rng = np.random.default_rng(seed)
+    codes = np.array([f"00{600 + i}{'LRKUB '[i % 6].strip()}" for i in range(N_ETFS)])
+    etf = np.arange(rows) % N_ETFS
+    per_row = (lambda values: values) if unique else (lambda values: values[etf])
+    size = rows if unique else N_ETFS
+    units = per_row(rng.integers(1_000_000, 5_000_000_000, size))
+    units_change = per_row(rng.integers(-50_000_000, 50_000_000, size))
+    prev_nav = per_row(np.round(rng.uniform(8, 150, size), 2))
+    if unique:
+        price = np.round(prev_nav * rng.uniform(0.95, 1.05, rows), 2)
+        nav = np.round(prev_nav * rng.uniform(0.95, 1.05, rows), 2)
+    else:
+        price = np.round(np.round(prev_nav * rng.uniform(0.98, 1.02, rows) / 0.05) * 0.05, 2)
+        nav = np.round(prev_nav * (1 + np.round(rng.normal(0, 0.005, rows), 3)), 2)
+    premium = np.char.add(np.round((price / nav - 1) * 100, 2).astype(str), '%')
+    premium[rng.random(rows) < PLACEHOLDER_RATE] = '-'
+    prev_nav_text = np.char.mod('%.2f', prev_nav).astype(object)
+    prev_nav_text[rng.random(rows) < PLACEHOLDER_RATE] = '未結出'
+    return pd.DataFrame({
+        '分類': np.array(['國內成分證券ETF', '國外成分證券ETF', '債券ETF'])[etf % 3],
+        'ETF代號/名稱': np.char.add(np.char.add(codes[etf], '/'), np.char.add('範例ETF', codes[etf])),
+        '已發行受益權單位數': [f"{v:,}" for v in units],
+        '與前日已發行受益單位差異數': [f"{v:,}" for v in units_change],
+        '成交價': [f"{v:,.2f}" for v in price],
+        '投信或總代理人預估淨值': [f"{v:,.2f}" for v in nav],
+        '預估折溢價幅度': premium,
+        '前一營業日單位淨值': prev_nav_text,
+        '資料時間': '2024/06/03 13:30:00',
+    })
+
+def legacy_load(frames):
+    """
+    The post-processing of load_data before the vectorized column schema.
+    """
+    ETF_data = pd.DataFrame()
+    for origin, df in frames.items():
+        df['交易所'] = origin
+        ETF_data = pd.concat([ETF_data, df], ignore_index=True)
+
+    ETF_data[['ETF代號', 'ETF名稱']] = ETF_data['ETF代號/名稱'].str.split('/', expand=True)
+    ETF_data['ETF代號'] = ETF_data['ETF代號'].str.strip()
+    ETF_data['ETF名稱'] = ETF_data['ETF名稱'].str.strip()
+    ETF_data = ETF_data.drop('ETF代號/名稱', axis=1)
+    ETF_data.columns = [re.sub(r'\([^()]*\)', '', col).replace('\n', '').strip() for col in ETF_data.columns]
+
+    ETF_data['yf_ticker'] = ETF_data.apply(lambda row: row['ETF代號'] + '.TW' if row['交易所'] == 'TSE' else row['ETF代號'] + '.TWO', axis=1)
+    ETF_data['已發行受益權單位數'] = ETF_data['已發行受益權單位數'].str.replace(',', '').astype(float)
+    ETF_data['與前日已發行受益單位差異數'] = ETF_data['與前日已發行受益單位差異數'].str.replace(',', '').astype(float)
+    ETF_data['成交價'] = ETF_data['成交價'].str.replace(',', '').astype(float)
+    ETF_data['投信或總代理人預估淨值'] = ETF_data['投信或總代理人預估淨值'].str.replace(',', '').astype(float)
+    ETF_data['預估折溢價幅度'] = ETF_data['預估折溢價幅度'].apply(lambda x: float(x.rstrip('%')) if x != '-' else 0)
+    ETF_data['前一營業日單位淨值'] = pd.to_numeric(ETF_data['前一營業日單位淨值'].str.replace('未結出', '').str.replace(',', ''), errors='coerce')
+    ETF_data['ETF市值'] = ETF_data['已發行受益權單位數'] * ETF_data['成交價']/100000000
+    ETF_data['ETF市值'] = ETF_data['ETF市值'].round(2).astype(float)
+
+    asset_type_mapping = {
+        'L': '正向槓桿型',
+        'R': '反向槓桿型',
+        'K': '外幣股票',
+        'U': '商品期貨',
+        'B': '台幣債券型',
+    }
+    def map_asset_type(code):
+        last_letter = code[-1]
+        return asset_type_mapping.get(last_letter, '台幣股票型')
+    ETF_data['資產類型'] = ETF_data['ETF代號'].apply(map_asset_type)
+    return ETF_data
+
+def current_load(frames):
+    with mock.patch.object(etf_nav.twse_etf, 'load_frames', return_value=frames):
+        return etf_nav.load_data('api')
+
+def best_time(load, tables):
+    times, result = [], None
+    for _ in range(REPEAT):
+        frames = {origin: table.copy() for origin, table in tables.items()}
+        start = time.perf_counter()
+        result = load(frames)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def check_same(legacy, current, tables):
+    """
+    Same values apart from the categorical dtypes and the placeholders,
+    which take the value COLUMN_SCHEMA gives them.
+    """
+    raw = pd.concat(tables.values(), ignore_index=True)
+    for column, fill in etf_nav.COLUMN_SCHEMA.items():
+        legacy.loc[raw[column].isin(etf_nav.PLACEHOLDERS).to_numpy(), column] = fill
+    current = current.astype({column: object for column in etf_nav.CATEGORICAL_COLUMNS})
+    pd.testing.assert_frame_equal(legacy.astype({column: object for column in etf_nav.CATEGORICAL_COLUMNS}),
+                                  current[legacy.columns], check_dtype=False)
+
+def main(sizes):
+    print(f"{'rows':>10} {'values':>9} {'before (s)':>11} {'after (s)':>10} {'speedup':>8} {'memory':>8}")
+    for rows in sizes:
+        for unique in (False, True):
+            tables = {'TSE': synthetic_table(rows - rows // 3, 0, unique), 'OTC': synthetic_table(rows // 3, 1, unique)}
+            before, legacy = best_time(legacy_load, tables)
+            after, current = best_time(current_load, tables)
+            memory = current.memory_usage(deep=True).sum() / legacy.memory_usage(deep=True).sum() - 1
+            check_same(legacy, current, tables)
+            print(f"{rows:>10,} {'unique' if unique else 'snapshot':>9} {before:>11.3f} {after:>10.3f} "
+                  f"{before / after:>7.1f}x {memory:>+8.0%}")
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [4_000, 400_000])
@@ -0,0 +1,145 @@
+"""
+Vectorized core of the ex-dividend buy/sell strategy shared by
+dividend_strategy_app.py and test.py.
+"""
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+
+import price_store
+
+TRANSACTION_FEE_RATE = 0.001425 * 0.28
+TRANSACTION_TAX_RATE = 0.001
+DAY_NS = 24 * 60 * 60 * 10**9
+
+def load_dividend_data(symbol, years):
+    """
+    Return (data, events): daily bars and the dividends paid in the last
+    `years` years, both indexed in Asia/Taipei time.
+    """
+    tz = pytz.timezone('Asia/Taipei')
+    end_date = datetime.now(tz)
+    start_date = end_date - timedelta(days=365*years)
+
+    # Ticker.history's default Close is dividend-adjusted, i.e. the store's Adj Close
+    data = price_store.load_history(symbol, start_date, end_date)
+    data['Close'] = data['Adj Close']
+    data.index = data.index.tz_localize(tz)
+    dividends = price_store.load_dividends(symbol, start_date, end_date)
+    dividends.index = dividends.index.tz_localize(tz)
+    events = dividends[dividends.index >= start_date]
+    return data, events
+
+def event_returns(price_dates, prices, ex_dates, dividends, before_days, after_days, dividend_tax_rate):
+    """
+    Resolve the buy and sell bars of every ex-dividend event at once and
+    return (valid, total_returns).
+
+    price_dates and ex_dates are int64 nanosecond timestamps (DatetimeIndex.asi8),
+    prices and dividends the matching float arrays. The buy bar is the last bar
+    on or before ex_date - before_days, the sell bar the first bar on or after
+    ex_date + after_days. before_days and after_days broadcast against ex_dates,
+    so a whole grid of windows can be evaluated in one call.
+    """
+    price_dates = np.asarray(price_dates)
+    prices = np.asarray(prices, dtype=float)
+    ex_dates = np.asarray(ex_dates)
+    before = np.asarray(before_days, dtype=np.int64) * DAY_NS
+    after = np.asarray(after_days, dtype=np.int64) * DAY_NS
+
+    buy_pos = np.searchsorted(price_dates, ex_dates - before, side='right') - 1
+    sell_pos = np.searchsorted(price_dates, ex_dates + after, side='left')
+    valid = (buy_pos >= 0) & (sell_pos < len(price_dates))
+    if len(price_dates) == 0:
+        return valid, np.full(valid.shape, np.nan)
+
+    buy_price = prices[np.clip(buy_pos, 0, len(prices) - 1)]
+    sell_price = prices[np.clip(sell_pos, 0, len(prices) - 1)]
+
+    buy_cost = buy_price * (1 + TRANSACTION_FEE_RATE)
+    sell_proceeds = sell_price * (1 - TRANSACTION_FEE_RATE - TRANSACTION_TAX_RATE)
+    after_tax_dividend = np.asarray(dividends, dtype=float) * (1 - dividend_tax_rate)
+
+    total_returns = (sell_proceeds - buy_cost + after_tax_dividend) / buy_cost
+    return valid, np.where(valid, total_returns, np.nan)
+
+def sweep(price_dates, prices, ex_dates, dividends, before_range, after_range, dividend_tax_rate, batch_size=16):
+    """
+    Evaluate every (before_days, after_days) pair of the two ranges against
+    one price/dividend history. Rows of before_range are processed in batches
+    to bound memory. Returns a dict of len(before_range) x len(after_range)
+    arrays: avg_return, hit_rate and event_count.
+    """
+    before_range = np.asarray(before_range)
+    after_range = np.asarray(after_range)
+    shape = (len(before_range), len(after_range))
+    result = {
+        'avg_return': np.full(shape, np.nan),
+        'hit_rate': np.full(shape, np.nan),
+        'event_count': np.zeros(shape, dtype=int),
+    }
+    for start in range(0, len(before_range), batch_size):
+        before = before_range[start:start + batch_size]
+        valid, total_returns = event_returns(
+            price_dates, prices, ex_dates, dividends,
+            before[:, None, None], after_range[None, :, None], dividend_tax_rate,
+        )
+        count = valid.sum(axis=2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result['avg_return'][start:start + len(before)] = np.where(valid, total_returns, 0).sum(axis=2) / count
+            result['hit_rate'][start:start + len(before)] = (valid & (total_returns > 0)).sum(axis=2) / count
+        result['event_count'][start:start + len(before)] = count
+    return result
+
+def screen_symbol(symbol, before_days, after_days, dividend_tax_rate, years=10, max_retries=3, retry_delay=5):
+    """
+    Run the strategy for one symbol, retrying failed downloads. Returns a
+    result row, or raises after the last attempt.
+    """
+    for attempt in range(max_retries):
+        try:
+            data, events = load_dividend_data(symbol, years)
+            if data.empty:
+                raise ValueError('no price data')
+            break
+        except Exception:
+            if attempt == max_retries - 1:
+                raise
+            time.sleep(retry_delay)
+
+    valid, total_returns = event_returns(
+        data.index.asi8, data['Close'].to_numpy(),
+        events.index.asi8, events.to_numpy(),
+        before_days, after_days, dividend_tax_rate,
+    )
+    returns = total_returns[valid]
+    return {
+        'symbol': symbol,
+        'avg_return': returns.mean() if len(returns) else np.nan,
+        'hit_rate': (returns > 0).mean() if len(returns) else np.nan,
+        'event_count': len(returns),
+        'last_ex_date': events.index[-1].strftime('%Y-%m-%d') if len(events) else None,
+    }
+
+def screen(symbols, before_days, after_days, dividend_tax_rate, years=10, max_workers=4):
+    """
+    Run screen_symbol for every symbol on a process pool and yield
+    (symbol, row, error) as each one finishes. A failing symbol yields its
+    error instead of stopping the others.
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        futures = {
+            executor.submit(screen_symbol, symbol, before_days, after_days, dividend_tax_rate, years): symbol
+            for symbol in dict.fromkeys(symbols)
+        }
+        for future in as_completed(futures):
+            symbol = futures[future]
+            try:
+                yield symbol, future.result(), None
+            except Exception as e:
+                yield symbol, None, str(e)
@@ -1,7 +1,10 @@
 import streamlit as st
-import yfinance as yf
+import dividend_strategy
+import os
+import time
 import pandas as pd
-from datetime import datetime, timedelta
+import numpy as np
+import plotly.express as px
 import pytz
 
 def analyze_dividend_strategy(symbol, before_days, after_days, dividend_tax_rate, years=10):
@@ -19,45 +22,14 @@ def analyze_dividend_strategy(symbol, before_days, after_days, dividend_tax_rate
     tuple: (平均回報率, 分析的除息事件數量, 詳細回報率列表)
     """
     tz = pytz.timezone('Asia/Taipei')
-    end_date = datetime.now(tz)
-    start_date = end_date - timedelta(days=365*years)
+    data, events = dividend_strategy.load_dividend_data(symbol, years)
     
-    stock = yf.Ticker(symbol)
-    data = stock.history(start=start_date, end=end_date)
-    dividends = stock.dividends
-    ex_dividend_dates = dividends.index.tz_convert(tz).tolist()
-    ex_dividend_dates = [date for date in ex_dividend_dates if date >= start_date]
-    
-    transaction_fee_rate = 0.001425 * 0.28
-    transaction_tax_rate = 0.001
-    
-    returns = []
-    
-    for ex_div_date in ex_dividend_dates:
-        buy_date = ex_div_date - timedelta(days=before_days)
-        sell_date = ex_div_date + timedelta(days=after_days)
-        
-        buy_dates = data.index[data.index <= buy_date]
-        sell_dates = data.index[data.index >= sell_date]
-        
-        if len(buy_dates) == 0 or len(sell_dates) == 0:
-            continue
-        
-        buy_date = buy_dates[-1]
-        sell_date = sell_dates[0]
-        
-        buy_price = data.loc[buy_date, 'Close']
-        sell_price = data.loc[sell_date, 'Close']
-        
-        buy_cost = buy_price * (1 + transaction_fee_rate)
-        sell_proceeds = sell_price * (1 - transaction_fee_rate - transaction_tax_rate)
-        
-        dividend_amount = dividends.loc[ex_div_date]
-        after_tax_dividend = dividend_amount * (1 - dividend_tax_rate)
-        
-        total_return = (sell_proceeds - buy_cost + after_tax_dividend) / buy_cost
-        
-        returns.append((ex_div_date, total_return))
+    valid, total_returns = dividend_strategy.event_returns(
+        data.index.asi8, data['Close'].to_numpy(),
+        events.index.asi8, events.to_numpy(),
+        before_days, after_days, dividend_tax_rate,
+    )
+    returns = list(zip(events.index.tz_convert(tz)[valid], total_returns[valid]))
     
     if not returns:
         return None, 0, []
@@ -65,15 +37,93 @@ def analyze_dividend_strategy(symbol, before_days, after_days, dividend_tax_rate
     avg_return = sum(return_value for _, return_value in returns) / len(returns)
     return avg_return, len(returns), returns
 
+@st.cache_data(ttl=3600)
+def sweep_dividend_strategy(symbol, years, dividend_tax_rate, max_before_days=60, max_after_days=60):
+    """
+    以同一份股價與除息資料，一次計算所有(買入天數, 賣出天數)組合的除息策略收益
+    
+    返回:
+    tuple: (買入天數, 賣出天數, {'avg_return', 'hit_rate', 'event_count'} 矩陣)
+    """
+    data, events = dividend_strategy.load_dividend_data(symbol, years)
+    before_range = np.arange(1, max_before_days + 1)
+    after_range = np.arange(1, max_after_days + 1)
+    result = dividend_strategy.sweep(
+        data.index.asi8, data['Close'].to_numpy(),
+        events.index.asi8, events.to_numpy(),
+        before_range, after_range, dividend_tax_rate,
+    )
+    return before_range, after_range, result
+
+def sweep_heatmap(values, before_range, after_range, title, fmt):
+    fig = px.imshow(values, x=after_range, y=before_range, origin='lower', aspect='auto',
+                    color_continuous_scale='RdYlBu_r',
+                    labels=dict(x='除息日後幾天賣出', y='除息日前幾天買入', color=title))
+    fig.update_traces(hovertemplate=f'買入: 前%{{y}}天<br>賣出: 後%{{x}}天<br>{title}: %{{z:{fmt}}}<extra></extra>')
+    fig.update_layout(title=title, margin=dict(t=40, l=10, r=10, b=10))
+    return fig
+
 st.title('股票除息策略分析')
 
-symbol = st.text_input('輸入股票代碼，上市股票加.TW;上櫃加.TWO (例如: 2330.TW 或 00720B.TWO)', '2330.TW')
-before_days = st.number_input('除息日前幾天買入', min_value=1, value=20)
-after_days = st.number_input('除息日後幾天賣出', min_value=1, value=20)
+mode = st.radio('分析模式', ['單一參數分析', '參數掃描', '多檔篩選'], horizontal=True)
+if mode == '多檔篩選':
+    symbols_text = st.text_area('輸入股票代碼清單 (以逗號或換行分隔)', '2330.TW, 0056.TW, 00878.TW')
+    symbols = [s.strip() for s in symbols_text.replace('\n', ',').split(',') if s.strip()]
+    if os.path.exists('hi_dvd.pkl') and st.checkbox('加入 hi_dvd.pkl 高股息清單'):
+        symbols += pd.read_pickle('hi_dvd.pkl')['yf_ticker'].tolist()
+    max_workers = st.slider('平行處理數', min_value=1, max_value=8, value=4)
+else:
+    symbol = st.text_input('輸入股票代碼，上市股票加.TW;上櫃加.TWO (例如: 2330.TW 或 00720B.TWO)', '2330.TW')
+if mode != '參數掃描':
+    before_days = st.number_input('除息日前幾天買入', min_value=1, value=20)
+    after_days = st.number_input('除息日後幾天賣出', min_value=1, value=20)
+else:
+    max_before_days = st.number_input('掃描買入天數上限 (除息日前)', min_value=1, max_value=120, value=60)
+    max_after_days = st.number_input('掃描賣出天數上限 (除息日後)', min_value=1, max_value=120, value=60)
 dividend_tax_rate = st.number_input('股息稅率 (%)', min_value=0, max_value=100, value=8) / 100
 years = st.number_input('分析年數', min_value=1, max_value=20, value=10)
 
-if st.button('進行分析'):
+if mode == '參數掃描':
+    if st.button('進行掃描'):
+        with st.spinner('正在掃描中...'):
+            before_range, after_range, result = sweep_dividend_strategy(
+                symbol, years, dividend_tax_rate, max_before_days, max_after_days)
+        
+        if result['event_count'].max() == 0:
+            st.error(f"警告：資料抓取錯誤或在指定的{years}年內沒有找到可分析的除息事件")
+        else:
+            best = np.unravel_index(np.nanargmax(result['avg_return']), result['avg_return'].shape)
+            st.success('掃描完成！')
+            st.write(f"最佳策略: 除息日前{before_range[best[0]]}天買入，除息日後{after_range[best[1]]}天賣出，"
+                     f"平均回報率 {result['avg_return'][best]:.2%}，勝率 {result['hit_rate'][best]:.0%}")
+            st.plotly_chart(sweep_heatmap(result['avg_return'] * 100, before_range, after_range, '平均回報率 (%)', '.2f'))
+            st.plotly_chart(sweep_heatmap(result['hit_rate'] * 100, before_range, after_range, '勝率 (%)', '.0f'))
+            st.plotly_chart(sweep_heatmap(result['event_count'], before_range, after_range, '除息事件數量', 'd'))
+
+elif mode == '多檔篩選':
+    if st.button('開始篩選'):
+        symbols = list(dict.fromkeys(symbols))
+        progress = st.progress(0.0, text='正在篩選中...')
+        table = st.empty()
+        rows, errors = [], []
+        start = time.time()
+        for done, (screened_symbol, row, error) in enumerate(dividend_strategy.screen(
+                symbols, before_days, after_days, dividend_tax_rate, years, max_workers), start=1):
+            if error is None:
+                rows.append(row)
+                ranked = pd.DataFrame(rows).sort_values('avg_return', ascending=False, ignore_index=True)
+                ranked.columns = ['股票代碼', '平均回報率', '勝率', '除息事件數量', '最近除息日']
+                table.dataframe(ranked.style.format({'平均回報率': '{:.2%}', '勝率': '{:.0%}'}))
+            else:
+                errors.append((screened_symbol, error))
+            progress.progress(done / len(symbols), text=f'已完成 {done}/{len(symbols)}: {screened_symbol}')
+        
+        st.success(f'篩選完成！共 {len(rows)} 檔，耗時 {time.time() - start:.0f} 秒')
+        if errors:
+            with st.expander(f'{len(errors)} 檔資料抓取失敗'):
+                st.dataframe(pd.DataFrame(errors, columns=['股票代碼', '錯誤訊息']))
+
+elif st.button('進行分析'):
     with st.spinner('正在分析中...'):
         result = analyze_dividend_strategy(symbol, before_days, after_days, dividend_tax_rate, years)
     
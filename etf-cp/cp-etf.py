@@ -1,43 +1,87 @@
 import streamlit as st
-import yfinance as yf
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-import empyrical as ep
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import price_store
+
+TRADING_DAYS = 252
+
+def compute_metrics(prices, benchmark):
+    """
+    Compute the performance table for every column of prices against the
+    benchmark column in one vectorized pass over a date x ticker matrix.
+    NaN masks keep each column on its own listing dates, so the results match
+    empyrical applied to each ticker's own return series.
+    """
+    values = prices.to_numpy(dtype=float)
+    previous = prices.ffill().shift(1).to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.where(np.isnan(values), np.nan, values / previous - 1)
+    valid = ~np.isnan(returns)
+    count = valid.sum(axis=0)
+    filled = np.where(valid, returns, 0.0)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        # Annual return and downside risk
+        ending_value = np.prod(1 + filled, axis=0)
+        annual_return = np.where(count > 0, ending_value ** (TRADING_DAYS / count) - 1, np.nan)
+        downside_risk = np.sqrt((np.minimum(filled, 0) ** 2).sum(axis=0) / count) * np.sqrt(TRADING_DAYS)
+        sortino_ratio = np.where(count > 1, filled.sum(axis=0) / count * TRADING_DAYS / downside_risk, np.nan)
+
+        # Max drawdown and Calmar ratio
+        cumulative = np.vstack([np.full((1, values.shape[1]), 100.0), 100 * np.cumprod(1 + filled, axis=0)])
+        running_max = np.fmax.accumulate(cumulative, axis=0)
+        max_drawdown = ((cumulative - running_max) / running_max).min(axis=0)
+        calmar_ratio = np.where(max_drawdown < 0, annual_return / np.abs(max_drawdown), np.nan)
+        calmar_ratio[np.isinf(calmar_ratio)] = np.nan
+
+        # Alpha and beta against the benchmark on the dates both have returns
+        factor = returns[:, [prices.columns.get_loc(benchmark)]]
+        paired = valid & ~np.isnan(factor)
+        paired_count = paired.sum(axis=0)
+        factor_mean = np.where(paired, factor, 0.0).sum(axis=0) / paired_count
+        residual = np.where(paired, factor - factor_mean, 0.0)
+        covariance = (residual * np.where(paired, returns, 0.0)).sum(axis=0) / paired_count
+        variance = (residual ** 2).sum(axis=0) / paired_count
+        variance[variance < 1.0e-30] = np.nan
+        beta = covariance / variance
+        alpha_mean = np.where(paired, returns - beta * factor, 0.0).sum(axis=0) / paired_count
+        alpha = np.where(paired_count > 1, (alpha_mean + 1) ** TRADING_DAYS - 1, np.nan)
+
+        # Total return from first to last available price
+        price_valid = ~np.isnan(values)
+        first = values[price_valid.argmax(axis=0), np.arange(values.shape[1])]
+        last = values[len(values) - 1 - price_valid[::-1].argmax(axis=0), np.arange(values.shape[1])]
+        total_return = last / first - 1
+
+    benchmark_return = total_return[prices.columns.get_loc(benchmark)]
+    return pd.DataFrame({
+        'ETF代號': [ticker.replace('.TW', '') for ticker in prices.columns],  # Remove '.TW' for display purposes
+        '年化報酬率 (%)': annual_return * 100,
+        '下檔風險 (%)': downside_risk * 100,
+        'sortino_ratio': sortino_ratio,
+        'Max Drawdown (%)': max_drawdown * 100,
+        'Calmar Ratio': calmar_ratio,
+        'Alpha (%)': alpha * 100,
+        'Beta (%)': beta * 100,
+        '總報酬 (%)': total_return * 100,
+        '指標報酬 (%)': np.full(values.shape[1], benchmark_return * 100),
+    }, index=prices.columns).round(2)
 
 def calculate_performance(tickers, benchmark='0050.TW', start_date=None, end_date=None):
-    benchmark_data = yf.download(benchmark, start=start_date, end=end_date, progress=False)['Adj Close']
-    benchmark_returns = benchmark_data.pct_change().dropna()
-    
-    results = []
-    for ticker in tickers:
-        try:
-            stock_data = yf.download(ticker, start=start_date, end=end_date, progress=False)['Adj Close']
-            stock_returns = stock_data.pct_change().dropna()
-            
-            metrics = {}
-            # Remove '.TW' from the ticker symbol for display purposes
-            metrics['ETF代號'] = ticker.replace('.TW', '')  
-            metrics['年化報酬率 (%)'] = ep.annual_return(stock_returns) * 100  # Added (%)
-            metrics['下檔風險 (%)'] = ep.downside_risk(stock_returns) * 100  # Added (%)
-            metrics['sortino_ratio'] = ep.sortino_ratio(stock_returns)
-            metrics['Max Drawdown (%)'] = ep.max_drawdown(stock_returns) * 100  # Added (%)
-            metrics['Calmar Ratio'] = ep.calmar_ratio(stock_returns)
-            metrics['Alpha (%)'] = ep.alpha(stock_returns, benchmark_returns) * 100  # Added (%)
-            metrics['Beta (%)'] = ep.beta(stock_returns, benchmark_returns) * 100  # Added (%)
-            metrics['總報酬 (%)'] = (stock_data.iloc[-1] / stock_data.iloc[0] - 1) * 100
-            metrics['指標報酬 (%)'] = (benchmark_data.iloc[-1] / benchmark_data.iloc[0] - 1) * 100
-            
-            for key, value in metrics.items():
-                if isinstance(value, (float, np.float64)):
-                    metrics[key] = round(value, 2)
-            
-            results.append(metrics)
-            
-        except Exception as e:
-            st.error(f"Error processing {ticker}: {str(e)}")
-    
-    return pd.DataFrame(results)
+    prices, failed = price_store.load_prices([benchmark] + list(tickers), start=start_date, end=end_date)
+    if benchmark in failed:
+        st.error(f"Error processing benchmark {benchmark}: no data")
+        return pd.DataFrame()
+    for ticker in failed:
+        st.error(f"Error processing {ticker}: no data")
+
+    metrics = compute_metrics(prices, benchmark)
+    return metrics.loc[[ticker for ticker in tickers if ticker not in failed]].reset_index(drop=True)
 
 def main():
     st.title("ETF個股風險績效分析")
@@ -0,0 +1,73 @@
+"""
+Parity check of compute_metrics against the per-ticker empyrical calls it
+replaced, on synthetic prices with late listings, gaps and the benchmark in
+the ticker list.
+"""
+import importlib.util
+import os
+import unittest
+
+import empyrical as ep
+import numpy as np
+import pandas as pd
+
+spec = importlib.util.spec_from_file_location(
+    'cp_etf', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cp-etf.py'))
+cp_etf = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(cp_etf)
+
+BENCHMARK = '0050.TW'
+
+def synthetic_prices(n_tickers=40, n_days=500, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2022-01-03', periods=n_days)
+    returns = rng.normal(0.0003, 0.012, (n_days, n_tickers))
+    prices = pd.DataFrame(50 * np.cumprod(1 + returns, axis=0), index=dates,
+                          columns=[BENCHMARK] + [f"00{700 + i}.TW" for i in range(n_tickers - 1)])
+    for i, ticker in enumerate(prices.columns[1:], 1):
+        if i % 3 == 0:  # listed after the start
+            prices.iloc[:rng.integers(20, n_days - 30), i] = np.nan
+        if i % 4 == 0:  # trading halts
+            prices.iloc[rng.choice(n_days, 15, replace=False), i] = np.nan
+    prices.iloc[rng.choice(n_days, 5, replace=False), 0] = np.nan
+    prices.iloc[-3:, -1] = np.nan  # delisted before the end
+    return prices
+
+def empyrical_metrics(prices, benchmark):
+    """
+    The table of the per-ticker empyrical loop compute_metrics replaced.
+    """
+    benchmark_data = prices[benchmark].dropna()
+    benchmark_returns = benchmark_data.pct_change().dropna()
+    rows = {}
+    for ticker in prices.columns:
+        stock_data = prices[ticker].dropna()
+        stock_returns = stock_data.pct_change().dropna()
+        rows[ticker] = {
+            '年化報酬率 (%)': ep.annual_return(stock_returns) * 100,
+            '下檔風險 (%)': ep.downside_risk(stock_returns) * 100,
+            'sortino_ratio': ep.sortino_ratio(stock_returns),
+            'Max Drawdown (%)': ep.max_drawdown(stock_returns) * 100,
+            'Calmar Ratio': ep.calmar_ratio(stock_returns),
+            'Alpha (%)': ep.alpha(stock_returns, benchmark_returns) * 100,
+            'Beta (%)': ep.beta(stock_returns, benchmark_returns) * 100,
+            '總報酬 (%)': (stock_data.iloc[-1] / stock_data.iloc[0] - 1) * 100,
+            '指標報酬 (%)': (benchmark_data.iloc[-1] / benchmark_data.iloc[0] - 1) * 100,
+        }
+    return pd.DataFrame.from_dict(rows, orient='index').round(2)
+
+class ComputeMetricsTest(unittest.TestCase):
+    def test_matches_empyrical(self):
+        prices = synthetic_prices()
+        actual = cp_etf.compute_metrics(prices, BENCHMARK)
+        expected = empyrical_metrics(prices, BENCHMARK)
+
+        self.assertEqual(list(actual['ETF代號']), [ticker.replace('.TW', '') for ticker in prices.columns])
+        for column in expected.columns:
+            with self.subTest(column=column):
+                # Both sides are rounded to 2 decimals, so values may differ by one unit in the last place
+                np.testing.assert_allclose(actual[column].to_numpy(dtype=float), expected[column].to_numpy(dtype=float),
+                                           rtol=0, atol=0.01 + 1e-9, equal_nan=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,104 +3,335 @@ import undetected_chromedriver as uc
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-import pandas as pd
+from selenium.common.exceptions import TimeoutException, WebDriverException
+import lxml.html
+import queue
+import threading
 import time
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import pandas as pd
 import re
-import plotly.express as px
+import plotly.graph_objects as go
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import treemap_agg
+import twse_etf
+import etf_snapshots
+import single_flight
 import numpy as np
 
-def scrape_etf_data(url):
-    options = uc.ChromeOptions()
-    options.add_argument("--headless")
-    
-    driver = uc.Chrome(options=options)
-    
-    driver.get(url)
-    wait = WebDriverWait(driver, 10)
-    wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "div.title")))
-    time.sleep(5)  # Additional wait for dynamic content
-    titles = driver.find_elements(By.CSS_SELECTOR, "div.title")
-    title_texts = [title.text.strip() for title in titles]     
-    tables = driver.find_elements(By.CSS_SELECTOR, "table.table")   
-    all_data = []    
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 60  # seconds between background refreshes during trading hours
+POLL_SOURCE = 'api'  # the JSON feeds in twse_etf.FEEDS; 'browser' also covers OTC and the categories
+
+# Numeric column -> value of its placeholder cells
+COLUMN_SCHEMA = {
+    '已發行受益權單位數': np.nan,
+    '與前日已發行受益單位差異數': np.nan,
+    '成交價': np.nan,
+    '投信或總代理人預估淨值': np.nan,
+    '預估折溢價幅度': np.nan,
+    '前一營業日單位淨值': np.nan,
+}
+PLACEHOLDERS = ['-', '未結出']
+# Last letter of the ETF code -> asset type; other codes are 台幣股票型
+ASSET_TYPES = {
+    'L': '正向槓桿型',
+    'R': '反向槓桿型',
+    'K': '外幣股票',
+    'U': '商品期貨',
+    'B': '台幣債券型',
+}
+CATEGORICAL_COLUMNS = ['分類', '交易所', '資產類型']
+
+class table_rows_loaded:
+    """
+    Wait condition: every table.table has data rows and the total row count
+    did not change since the previous poll.
+    """
+    def __init__(self):
+        self.last_count = None
+
+    def __call__(self, driver):
+        counts = driver.execute_script(
+            "return Array.from(document.querySelectorAll('table.table'), t => t.querySelectorAll('tr').length)")
+        count = sum(counts)
+        ready = bool(counts) and min(counts) > 1 and count == self.last_count
+        self.last_count = count
+        return ready
+
+def element_text(element):
+    """
+    Text of an lxml element the way WebElement.text renders it: <br> breaks
+    lines and runs of whitespace collapse.
+    """
+    for br in element.iter('br'):
+        br.tail = '\n' + (br.tail or '')
+    lines = (' '.join(line.split()) for line in element.text_content().split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+def has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+def parse_etf_tables(page_source):
+    tree = lxml.html.fromstring(page_source)
+    title_texts = [element_text(title) for title in tree.xpath(f"//div[{has_class('title')}]")]
+    tables = tree.xpath(f"//table[{has_class('table')}]")
+    all_data = []
     for i, table in enumerate(tables):
         title = title_texts[i] if i < len(title_texts) else "未分類"
-        headers = ['分類'] + [th.text.strip() for th in table.find_elements(By.TAG_NAME, "th")]   
-        rows = table.find_elements(By.TAG_NAME, "tr")[1:]  # Skip header row
+        headers = ['分類'] + [element_text(th) for th in table.iter('th')]
+        rows = list(table.iter('tr'))[1:]  # Skip header row
         data = []
         for row in rows:
-            cells = row.find_elements(By.TAG_NAME, "td")
-            row_data = [title] + [cell.text.strip() for cell in cells]
+            row_data = [title] + [element_text(cell) for cell in row.iter('td')]
             if len(row_data) == len(headers):
                 data.append(row_data)
-        
+
         df = pd.DataFrame(data, columns=headers)
         all_data.append(df)
-    
-    final_df = pd.concat(all_data, ignore_index=True)
-    driver.quit()
-    return final_df
-
-def load_data():
-    urls = [
-        "https://mis.twse.com.tw/stock/various-areas/etf-price/indicator-disclosure-etf?lang=zhHant",
-        "https://mis.twse.com.tw/stock/various-areas/etf-price/value-disclosure-etf?lang=zhHant"
-    ]
+
+    return pd.concat(all_data, ignore_index=True)
+
+class ChromePool:
+    """
+    Process-wide pool of headless Chrome drivers shared by every Streamlit
+    session. Drivers are started lazily and reused across loads. A driver is
+    replaced when it stops responding, raises during a load, or has served
+    max_uses pages, since Chrome's memory grows with every page.
+    """
+    def __init__(self, size=2, max_uses=50):
+        self.max_uses = max_uses
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        options = uc.ChromeOptions()
+        options.add_argument("--headless")
+        # uc patches the chromedriver binary on start, which is not safe to run concurrently
+        with self._start_lock:
+            driver = uc.Chrome(options=options)
+        driver.pool_uses = 0
+        return driver
+
+    def _checkout(self):
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                return self._start()
+            try:
+                driver.title  # liveness check
+                return driver
+            except WebDriverException:
+                self._discard(driver)
+
+    def _discard(self, driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    @contextmanager
+    def driver(self):
+        with self._slots:
+            driver = self._checkout()
+            try:
+                yield driver
+            except BaseException:
+                self._discard(driver)
+                raise
+            driver.pool_uses += 1
+            if driver.pool_uses >= self.max_uses:
+                self._discard(driver)
+            else:
+                self._idle.put(driver)
+
+@st.cache_resource
+def get_chrome_pool():
+    return ChromePool()
+
+def scrape_etf_data(url):
+    # Sessions loading the same page at once share one browser visit
+    def scrape():
+        with get_chrome_pool().driver() as driver:
+            driver.get(url)
+            wait = WebDriverWait(driver, 10)
+            wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "div.title")))
+            try:
+                WebDriverWait(driver, 15, poll_frequency=0.5).until(table_rows_loaded())
+            except TimeoutException:
+                pass  # parse whatever has rendered
+            # One round trip for the whole page instead of one per cell
+            page_source = driver.page_source
+        return parse_etf_tables(page_source)
+    return single_flight.do('selenium', url, scrape)
+
+def parse_columns(ETF_data):
+    """
+    Parse every COLUMN_SCHEMA column in one vectorized pass: thousands
+    separators and '%' are stripped, placeholders take their schema value and
+    anything else unparseable becomes NaN.
+    """
+    columns = [column for column in COLUMN_SCHEMA if column in ETF_data.columns]
+    raw = ETF_data[columns].astype(str).to_numpy()
+    # Snapshots repeat most cells (unit counts, NAVs, placeholders), so only distinct strings are parsed
+    codes, uniques = pd.factorize(raw.ravel())
+    cleaned = pd.Series(uniques).str.replace(',', '', regex=False).str.rstrip('%').str.strip()
+    values = pd.to_numeric(cleaned, errors='coerce').to_numpy(dtype=float)
+    parsed = values[codes].reshape(raw.shape)
+    fill = np.array([COLUMN_SCHEMA[column] for column in columns], dtype=float)
+    parsed = np.where(np.isin(raw, PLACEHOLDERS), fill, parsed)
+    return ETF_data.assign(**dict(zip(columns, parsed.T)))
+
+def load_data(source='browser', report=st.error):
+    """
+    source: 'browser' scrapes the disclosure pages with Chrome, 'api' reads
+    their JSON feeds directly and 'fixture' replays recorded feeds offline.
+    report is called with each error message; callers outside a script run
+    pass their own, as st calls need one.
+    """
+    if source == 'browser':
+        urls = [
+            "https://mis.twse.com.tw/stock/various-areas/etf-price/indicator-disclosure-etf?lang=zhHant",
+            "https://mis.twse.com.tw/stock/various-areas/etf-price/value-disclosure-etf?lang=zhHant"
+        ]
+
+        # Both pages load in parallel on pooled drivers
+        with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+            frames = dict(zip(urls, executor.map(scrape_etf_data, urls)))
+    else:
+        frames = twse_etf.load_frames(source)
 
     ETF_data = pd.DataFrame()
-    for url in urls:
-        df = scrape_etf_data(url)
+    for origin, df in frames.items():
         if not df.empty:
-            df['交易所'] = 'TSE' if "indicator-disclosure-etf" in url else 'OTC'
-            ETF_data = pd.concat([ETF_data, df], ignore_index=True)
+            # Scraped frames can be shared with other sessions, so they are not modified
+            if source == 'browser':
+                exchange = 'TSE' if "indicator-disclosure-etf" in origin else 'OTC'
+            else:
+                exchange = origin
+            ETF_data = pd.concat([ETF_data, df.assign(交易所=exchange)], ignore_index=True)
         else:
-            st.error(f"No data retrieved from {url}")
+            report(f"No data retrieved from {origin}")
 
     if 'ETF代號/名稱' in ETF_data.columns:
-        ETF_data[['ETF代號', 'ETF名稱']] = ETF_data['ETF代號/名稱'].str.split('/', expand=True)
-        ETF_data['ETF代號'] = ETF_data['ETF代號'].str.strip()
-        ETF_data['ETF名稱'] = ETF_data['ETF名稱'].str.strip()
+        codes, uniques = pd.factorize(ETF_data['ETF代號/名稱'])
+        split = pd.Series(uniques).str.split('/', n=1, expand=True)
+        ETF_data['ETF代號'] = split[0].str.strip().to_numpy()[codes]
+        ETF_data['ETF名稱'] = split[1].str.strip().to_numpy()[codes]
         ETF_data = ETF_data.drop('ETF代號/名稱', axis=1)
     else:
-        st.error("Column 'ETF代號/名稱' not found in the DataFrame")
+        report("Column 'ETF代號/名稱' not found in the DataFrame")
 
     ETF_data.columns = [re.sub(r'\([^()]*\)', '', col).replace('\n', '').strip() for col in ETF_data.columns]
 
-    ETF_data['yf_ticker'] = ETF_data.apply(lambda row: row['ETF代號'] + '.TW' if row['交易所'] == 'TSE' else row['ETF代號'] + '.TWO', axis=1)
-    ETF_data['已發行受益權單位數'] = ETF_data['已發行受益權單位數'].str.replace(',', '').astype(float)
-    ETF_data['與前日已發行受益單位差異數'] = ETF_data['與前日已發行受益單位差異數'].str.replace(',', '').astype(float)
-    ETF_data['成交價'] = ETF_data['成交價'].str.replace(',', '').astype(float)
-    ETF_data['投信或總代理人預估淨值'] = ETF_data['投信或總代理人預估淨值'].str.replace(',', '').astype(float)
-    ETF_data['預估折溢價幅度'] = ETF_data['預估折溢價幅度'].apply(lambda x: float(x.rstrip('%')) if x != '-' else 0)
-    ETF_data['前一營業日單位淨值'] = pd.to_numeric(ETF_data['前一營業日單位淨值'].str.replace('未結出', '').str.replace(',', ''), errors='coerce')
+    ETF_data = parse_columns(ETF_data)
+    ETF_data['yf_ticker'] = ETF_data['ETF代號'] + np.where(ETF_data['交易所'] == 'TSE', '.TW', '.TWO')
     ETF_data['ETF市值'] = ETF_data['已發行受益權單位數'] * ETF_data['成交價']/100000000
     ETF_data['ETF市值'] = ETF_data['ETF市值'].round(2).astype(float)
+    ETF_data['資產類型'] = ETF_data['ETF代號'].str[-1].map(ASSET_TYPES).fillna('台幣股票型')
 
-    asset_type_mapping = {
-        'L': '正向槓桿型',
-        'R': '反向槓桿型',
-        'K': '外幣股票',
-        'U': '商品期貨',
-        'B': '台幣債券型',
-    }
-    def map_asset_type(code):
-        last_letter = code[-1]
-        return asset_type_mapping.get(last_letter, '台幣股票型')
-    ETF_data['資產類型'] = ETF_data['ETF代號'].apply(map_asset_type)
+    for column in CATEGORICAL_COLUMNS:
+        if column in ETF_data.columns:
+            ETF_data[column] = ETF_data[column].astype('category')
 
     return ETF_data
 
-def create_treemap(df):
+@st.cache_resource
+def start_poller(source=POLL_SOURCE, interval=POLL_INTERVAL):
+    """
+    Start the one background thread per server process that appends a fresh
+    snapshot to etf_snapshots every `interval` seconds during trading hours.
+    Returns its status dict. The thread has no script run context, so its
+    errors are logged and kept in the status instead of shown with st.
+    """
+    status = {'last_run': None, 'last_error': None, 'new_rows': 0}
+    errors = []
+
+    def report(message):
+        logger.error(message)
+        errors.append(message)
+
+    def run():
+        while True:
+            if etf_snapshots.is_trading_time():
+                errors.clear()
+                try:
+                    status['new_rows'] = etf_snapshots.append(load_data(source, report=report))
+                except Exception as e:
+                    logger.exception("ETF snapshot poll failed")
+                    errors.append(str(e))
+                status['last_error'] = '; '.join(errors) or None
+                status['last_run'] = datetime.now(etf_snapshots.TIMEZONE)
+            time.sleep(interval)
+
+    threading.Thread(target=run, name='etf-nav-poller', daemon=True).start()
+    return status
+
+def create_intraday_chart(path):
+    fig = go.Figure()
+    for code in path.columns:
+        fig.add_trace(go.Scatter(x=path.index, y=path[code], mode='lines', name=code))
+    fig.add_hline(y=0, line_color='gray', line_dash='dot')
+    fig.update_layout(yaxis_title='預估折溢價幅度 (%)', hovermode='x unified', margin=dict(t=20, l=25, r=20, b=20))
+    return fig
+
+def show_intraday(data):
+    st.subheader("盤中折溢價走勢")
+    days = etf_snapshots.trading_days()
+    if not days:
+        st.info("尚無盤中快照")
+        return
+    day = st.selectbox("交易日", days)
+    path = etf_snapshots.intraday(day)
+
+    col1, col2 = st.columns(2)
+    threshold = col1.number_input("偏離門檻 (%)", min_value=0.1, value=1.0, step=0.1)
+    min_streak = col2.number_input("連續快照數", min_value=2, value=5, step=1)
+    streaks = etf_snapshots.deviation_streaks(path, threshold)
+    flagged = streaks[streaks['連續偏離次數'] >= min_streak].sort_values('連續偏離次數', ascending=False)
+    names = data.set_index('ETF代號')['ETF名稱'] if data is not None else pd.Series(dtype=object)
+    if flagged.empty:
+        st.caption(f"沒有 ETF 連續 {min_streak} 次偏離超過 {threshold}%")
+    else:
+        st.dataframe(flagged.assign(ETF名稱=names.reindex(flagged.index)).round(2))
+
+    default = list(flagged.index[:5]) or list(path.columns[:5])
+    codes = st.multiselect("ETF", list(path.columns), default=default)
+    if codes:
+        st.plotly_chart(create_intraday_chart(path[codes]), use_container_width=True)
+
+def snapshot_times(df):
+    """
+    Latest 資料時間 of each exchange. The stored snapshot can hold exchanges
+    fetched at different times, e.g. OTC rows of a browser fetch next to
+    newer TSE rows of the poller.
+    """
+    return df.groupby('交易所', observed=True)['資料時間'].max()
+
+def create_treemap(df, max_etfs=None):
     df = df[df['ETF市值'].notna() & (df['ETF市值'] != 0)]
     color = '預估折溢價幅度'
     values = 'ETF市值'
 
-    col_values = df[color]
-    weights = df[values]
-    weighted_mean = np.average(col_values, weights=weights)
-    weighted_std_dev = np.sqrt(np.average((col_values - weighted_mean)**2, weights=weights))
-
-    color_range = max(abs(weighted_mean - 2 * weighted_std_dev), abs(weighted_mean + 2 * weighted_std_dev))
+    # ETFs without an estimated premium ('-') are left out of the color scale
+    colored = df[df[color].notna()]
+    if colored.empty:
+        color_range = 1
+    else:
+        col_values = colored[color]
+        weights = colored[values]
+        weighted_mean = np.average(col_values, weights=weights)
+        weighted_std_dev = np.sqrt(np.average((col_values - weighted_mean)**2, weights=weights))
+        color_range = max(abs(weighted_mean - 2 * weighted_std_dev), abs(weighted_mean + 2 * weighted_std_dev))
     lower_limit = -color_range
     upper_limit = color_range
 
@@ -112,14 +343,22 @@ def create_treemap(df):
         (1, "darkred")
     ]
 
-    data_time = df.iloc[0]['資料時間']
-    fig = px.treemap(df, path=[px.Constant(f'ALL_ETF   {data_time}'),'資產類型' ,'ETF代號'], values=values, color=color,
-                     color_continuous_scale=color_scale,
-                     color_continuous_midpoint = 0,
-                     range_color=[lower_limit,upper_limit],
-                     hover_data=['ETF代號','ETF名稱','成交價'])
+    times = snapshot_times(df)
+    data_time = times.iloc[0] if times.nunique() == 1 else '  '.join(f"{exchange} {latest}" for exchange, latest in times.items())
+    # Build the hierarchy server-side, folding the smallest ETFs of each asset type into one node
+    nodes = treemap_agg.aggregate(df, path=['資產類型', 'ETF代號'], values=values, color=color,
+                                  root=f'ALL_ETF   {data_time}',
+                                  custom_data=['ETF代號', 'ETF名稱', '成交價'],
+                                  max_leaves=max_etfs)
+    is_leaf = nodes['成交價'].notna()
+    fig = go.Figure(go.Treemap(ids=nodes['id'], labels=nodes['label'], parents=nodes['parent'],
+                               values=nodes['value'], branchvalues='total',
+                               marker=dict(colors=nodes['color'], colorscale=color_scale,
+                                           cmin=lower_limit, cmax=upper_limit,
+                                           showscale=True, colorbar=dict(title=color)),
+                               customdata=nodes[['ETF代號', 'ETF名稱', '成交價']].fillna('').to_numpy()))
     fig.update_traces(hovertemplate='<b>%{label}</b><br>市值:%{value:,.0f}億<br>%{color:.2f}%')
-    fig.data[0].texttemplate = "%{customdata[0]}</br>%{customdata[1]}<br>價:%{customdata[2]:,.1f}"
+    fig.data[0].texttemplate = np.where(is_leaf, "%{customdata[0]}</br>%{customdata[1]}<br>價:%{customdata[2]:,.1f}", "%{label}")
     fig.data[0]['textfont']['size'] = 12
     fig.update_layout(margin=dict(t=20, l=25, r=20, b=20))
     return fig
@@ -128,22 +367,52 @@ def main():
     st.set_page_config(page_title="ETF Data Visualization", layout="wide")
     st.title("ETF 折溢價圖")
 
+    status = start_poller()
     if 'data' not in st.session_state:
         st.session_state.data = None
 
+    source = st.radio("資料來源", ['browser', 'api', 'fixture'], horizontal=True,
+                      format_func={'browser': '瀏覽器 (Selenium)', 'api': 'JSON API', 'fixture': '離線範例'}.get)
+    if source != 'browser':
+        # twse_etf.FEEDS has no OTC feed, and the fixture is in the TSE feed's layout
+        st.caption(f"JSON API 僅涵蓋 {'、'.join(twse_etf.FEEDS)} 的 ETF，不含上櫃 (OTC) ETF 與分類")
     if st.button("抓取/更新資料"):
         with st.spinner("Fetching fresh data..."):
-            st.session_state.data = load_data()
+            st.session_state.data = load_data(source)
+        if source != 'fixture':
+            etf_snapshots.append(st.session_state.data)
+        # Offline fixture data is not in the store, so it stays up until the next fetch
+        st.session_state.pinned = source == 'fixture'
         st.success("Data fetched successfully!")
+    elif not st.session_state.get('pinned'):
+        # Follow the poller: every rerun shows the latest stored snapshot
+        latest = etf_snapshots.latest()
+        if latest is not None:
+            st.session_state.data = latest
+    if status['last_run'] is not None:
+        st.caption(f"背景更新: {status['last_run']:%H:%M:%S}" + (f" ({status['last_error']})" if status['last_error'] else ""))
+    if POLL_SOURCE != 'browser':
+        # The JSON feeds have no section titles, and only the exchanges configured in twse_etf.FEEDS
+        st.caption(f"背景更新僅涵蓋 {'、'.join(twse_etf.FEEDS)} 的 ETF，且不含分類；"
+                   "其他交易所 (如上櫃) 與分類請以瀏覽器 (Selenium) 抓取")
 
     if st.session_state.data is not None:
-        fig = create_treemap(st.session_state.data)
+        max_etfs = st.select_slider("Treemap 顯示 ETF 數", options=[50, 100, 200, '全部'], value='全部')
+        fig = create_treemap(st.session_state.data, None if max_etfs == '全部' else max_etfs)
         st.plotly_chart(fig, use_container_width=True)
+        times = snapshot_times(st.session_state.data)
+        if times.nunique() > 1:
+            st.caption("各交易所資料時間不同: " + "、".join(f"{exchange} {latest}" for exchange, latest in times.items()))
 
         st.subheader("Raw Data")
         st.dataframe(st.session_state.data)
+
+        show_intraday(st.session_state.data)
     else:
         st.info("點擊'抓取/更新資料'按鈕更新資料 ")
 
+    with st.sidebar.expander("上游請求統計"):
+        st.dataframe(single_flight.stats())
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,167 @@
+"""
+Local SQLite time series of ETF NAV disclosure snapshots.
+
+Every refresh of the ETF NAV table is appended keyed by (資料時間, ETF代號),
+so repeated polls of an unchanged feed cost nothing and every session can
+read the latest snapshot, or a whole day's premium/discount path, without
+scraping on demand.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, time
+
+import numpy as np
+import pandas as pd
+import pytz
+
+DB_PATH = os.environ.get(
+    'ETF_SNAPSHOT_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'etf_nav.sqlite'),
+)
+TIMEZONE = pytz.timezone('Asia/Taipei')
+# The feed lags the market by a few seconds, so the closing snapshot arrives after 13:30
+TRADING_HOURS = (time(9, 0), time(13, 35))
+
+# Table column -> load_data column
+COLUMNS = {
+    'data_time': '資料時間',
+    'code': 'ETF代號',
+    'name': 'ETF名稱',
+    'exchange': '交易所',
+    'asset_type': '資產類型',
+    'category': '分類',
+    'yf_ticker': 'yf_ticker',
+    'units': '已發行受益權單位數',
+    'units_change': '與前日已發行受益單位差異數',
+    'price': '成交價',
+    'nav': '投信或總代理人預估淨值',
+    'premium': '預估折溢價幅度',
+    'prev_nav': '前一營業日單位淨值',
+    'market_cap': 'ETF市值',
+}
+
+_lock = threading.Lock()
+
+@contextmanager
+def _connect():
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        with conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    data_time TEXT, code TEXT, name TEXT, exchange TEXT, asset_type TEXT,
+                    category TEXT, yf_ticker TEXT, units REAL, units_change REAL, price REAL,
+                    nav REAL, premium REAL, prev_nav REAL, market_cap REAL,
+                    PRIMARY KEY (data_time, code)
+                )
+                """
+            )
+            yield conn
+    finally:
+        conn.close()
+
+def is_trading_time(now=None):
+    now = now or datetime.now(TIMEZONE)
+    return now.weekday() < 5 and TRADING_HOURS[0] <= now.time() <= TRADING_HOURS[1]
+
+def _from_rows(data):
+    data = data.rename(columns=COLUMNS)
+    # Back to the feed's own 'YYYY/MM/DD HH:MM:SS' text
+    data['資料時間'] = pd.to_datetime(data['資料時間']).dt.strftime('%Y/%m/%d %H:%M:%S')
+    return data
+
+def append(df):
+    """
+    Append a load_data frame to the store. Rows already stored for the same
+    資料時間 are ignored. Returns the number of new rows.
+    """
+    if df is None or df.empty or 'ETF代號' not in df.columns:
+        return 0
+    rows = df.reindex(columns=list(COLUMNS.values())).rename(columns={v: k for k, v in COLUMNS.items()})
+    rows['data_time'] = pd.to_datetime(rows['data_time'], errors='coerce').dt.strftime('%Y-%m-%d %H:%M:%S')
+    rows = rows.dropna(subset=['data_time', 'code'])
+    rows = rows.astype(object).where(rows.notna(), None)
+    placeholders = ', '.join('?' * len(COLUMNS))
+    with _lock, _connect() as conn:
+        before = conn.total_changes
+        conn.executemany(f'INSERT OR IGNORE INTO snapshots VALUES ({placeholders})',
+                         rows.itertuples(index=False, name=None))
+        return conn.total_changes - before
+
+def latest():
+    """
+    Return the latest stored row of every ETF quoted on the latest trading
+    day, in the load_data layout, or None if nothing is stored yet.
+    """
+    with _connect() as conn:
+        data = pd.read_sql_query(
+            """
+            SELECT s.* FROM snapshots s
+            JOIN (SELECT code, MAX(data_time) AS data_time FROM snapshots
+                  WHERE data_time >= (SELECT substr(MAX(data_time), 1, 10) FROM snapshots)
+                  GROUP BY code) m
+            ON s.code = m.code AND s.data_time = m.data_time
+            ORDER BY s.market_cap DESC
+            """,
+            conn,
+        )
+    if data.empty:
+        return None
+    return _from_rows(data)
+
+def trading_days():
+    with _connect() as conn:
+        rows = conn.execute('SELECT DISTINCT substr(data_time, 1, 10) FROM snapshots ORDER BY 1 DESC').fetchall()
+    return [row[0] for row in rows]
+
+def intraday(day=None, codes=None):
+    """
+    Return the premium/discount path of one trading day ('YYYY-MM-DD', the
+    latest by default) as a 資料時間 x ETF代號 frame.
+    """
+    day = day or next(iter(trading_days()), None)
+    if day is None:
+        return pd.DataFrame()
+    query = 'SELECT data_time, code, premium FROM snapshots WHERE data_time >= ? AND data_time < ?'
+    params = [day, day + '~']
+    if codes:
+        query += f" AND code IN ({', '.join('?' * len(codes))})"
+        params += list(codes)
+    with _connect() as conn:
+        data = pd.read_sql_query(query, conn, params=params)
+    path = data.pivot(index='data_time', columns='code', values='premium')
+    path.index = pd.DatetimeIndex(pd.to_datetime(path.index), name='資料時間')
+    path.columns.name = 'ETF代號'
+    return path
+
+def deviation_streaks(path, threshold):
+    """
+    For every ETF of an intraday path, count the consecutive latest snapshots
+    whose premium/discount is at least `threshold` percent in the same
+    direction. Returns a frame with 連續偏離次數, 偏離方向 and the mean
+    premium over the streak.
+    """
+    values = path.ffill().to_numpy(dtype=float)
+    if values.size == 0:
+        return pd.DataFrame(columns=['連續偏離次數', '偏離方向', '平均折溢價'])
+    direction = np.sign(values) * (np.abs(values) >= threshold)
+    last = direction[-1]
+
+    # Length of the trailing run equal to the last snapshot's direction
+    same = (direction == last) & (last != 0)
+    breaks = np.where(~same, np.arange(len(same))[:, None], -1)
+    streak = len(same) - 1 - np.maximum.accumulate(breaks, axis=0)[-1]
+
+    rows = np.arange(len(values))[:, None] >= len(values) - streak
+    with np.errstate(invalid='ignore'):
+        mean = np.where(rows, values, 0).sum(axis=0) / streak
+    return pd.DataFrame({
+        '連續偏離次數': streak,
+        '偏離方向': np.select([last > 0, last < 0], ['溢價', '折價'], ''),
+        '平均折溢價': mean,
+    }, index=path.columns)
@@ -1,54 +1,79 @@
 import streamlit as st
-import numpy as np
-import pandas as pd
-import datetime
+import os
+import sys
 import warnings
 warnings.filterwarnings("ignore")
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ifrs9_store
+import single_flight
+
 # Set page title
 st.set_page_config(page_title="主要壽險公司 IFRS 9 資產佔比")
 
 # Title
 st.title("主要壽險公司 IFRS 9 資產佔比")
+# The insurer list is configured, not read from the regulator, and each page only shows its latest periods
+st.caption(f"涵蓋 {len(ifrs9_store.INSURERS)} 家設定的壽險公司 (ifrs9_store.INSURERS，可用 IFRS9_INSURERS 增加)，"
+           "並非全體壽險業；歷史資料只包含各公司頁面顯示過的期間，自開始抓取起逐季累積。")
+
+with st.sidebar.expander("上游請求統計"):
+    st.dataframe(single_flight.stats())
 
-# Define insurance companies and their IDs
-Name = ['新光人壽', '國泰人壽', '南山人壽', '富邦人壽', '台灣人壽', '中國人壽', '全球人壽']
-ID = ['03458902','03374707','11456006','27935073','03557017','03434016','70817744']
-insurance_dict = dict(zip(Name, ID))
+CACHE_TTL = 6 * 60 * 60  # a new quarter shows up within this many seconds
+
+class PartialData(Exception):
+    """
+    Raised out of the cached loader so that a result with failed pages is not
+    cached; the store retries those pages after ifrs9_store.RETRY_INTERVAL.
+    """
+    def __init__(self, panel, errors):
+        super().__init__(errors)
+        self.panel = panel
+        self.errors = errors
 
 # Function to fetch and process data
-@st.cache_data
+@st.cache_data(ttl=CACHE_TTL)
 def fetch_and_process_data():
-    data = pd.read_html(f'https://ins-info.ib.gov.tw/customer/Info2-2.aspx?UID={ID[0]}', 
-                        encoding='utf-8')[1].iloc[[5,10,7,20],[2,3,4,5]]
-    data.set_index('項目', inplace=True)
-    data = (data/100000).astype(int)
-    Period = data.columns[0]
-    
-    佔總資產比 = []
-    金融資產佔比 = []
-    
-    for i in range(len(ID)):
-        IFRS9_Ratio = pd.read_html(f'https://ins-info.ib.gov.tw/customer/Info2-2.aspx?UID={ID[i]}', encoding='utf-8')[1]
-        IFRS9_Ratio = IFRS9_Ratio.iloc[[5,10,7,20]][['項目',Period]]
-        IFRS9_Ratio['佔比'] = [round(IFRS9_Ratio.iloc[i][Period]/IFRS9_Ratio.iloc[-1][Period], 2) for i in range(len(IFRS9_Ratio))]
-        佔總資產比.append(list(IFRS9_Ratio['佔比']))
-        
-        sum_of_first_three = sum(佔總資產比[-1][:3])
-        individual_金融資產佔比 = [x / sum_of_first_three for x in 佔總資產比[-1][:3]]
-        金融資產佔比.append(individual_金融資產佔比)
-    
-    佔總資產比_df = pd.DataFrame(佔總資產比, index=insurance_dict.keys(), columns=["FVPL_PLO", "FVOCI","AC","總資產"])
-    佔總資產比_df['金融資產'] = 佔總資產比_df['FVPL_PLO'] + 佔總資產比_df['FVOCI'] + 佔總資產比_df['AC']
-    
-    return 佔總資產比_df, Period
+    """
+    Refresh the local IFRS 9 history and return the panel. Raises PartialData
+    with the panel and {company: error} if some pages failed, and
+    RuntimeError if nothing is stored and every page failed.
+    """
+    panel, errors = ifrs9_store.load_panel()
+    if panel is None or panel.empty:
+        raise RuntimeError("; ".join(f"{name}: {error}" for name, error in errors.items()))
+    if errors:
+        raise PartialData(panel, errors)
+    return panel
 
 # Fetch and process data
-df, period = fetch_and_process_data()
+try:
+    panel, errors = fetch_and_process_data(), {}
+except PartialData as e:
+    panel, errors = e.panel, e.errors
+except RuntimeError as e:
+    st.error(f"無法取得資料: {e}")
+    st.stop()
+
+if errors:
+    st.warning("以下公司資料抓取失敗，顯示先前儲存的資料: " + "、".join(errors))
+    with st.expander("錯誤訊息"):
+        for name, error in errors.items():
+            st.write(f"{name}: {error}")
+    if st.button("重新抓取"):
+        ifrs9_store.load_panel(force=True)
+        fetch_and_process_data.clear()
+        st.rerun()
+
+ratios = ifrs9_store.allocation(panel)
+periods = ifrs9_store.periods(panel)
+period = st.selectbox("資料日期", periods[::-1])
+df = ratios.xs(period, level='期間').round(2)
+df = df.loc[[name for name in ifrs9_store.INSURERS if name in df.index]]
 
 # Display the period
 st.write(f"資料日期: {period}")
-
 # Create a bar chart
 st.write("IFRS 9 分類資產佔總資產比例")
 chart_data = df[['FVPL_PLO', 'FVOCI', 'AC']]
@@ -66,4 +91,14 @@ st.write("""
 - AC: Amortized Cost
 """)
 
-# You can add more visualizations or analysis here as needed
+# Trends across periods
+st.subheader("IFRS 9 分類資產佔比趨勢")
+companies = panel['公司'].unique()
+# Only the insurers configured in ifrs9_store.INSURERS are scraped, not the whole industry
+st.write(f"{len(companies)} 家壽險公司合計 ({'、'.join(companies)})")
+st.line_chart(ifrs9_store.industry_allocation(panel))
+
+category = st.radio("類別", ['FVPL_PLO', 'FVOCI', 'AC', '金融資產'], horizontal=True)
+trend = ratios[category].unstack('公司').reindex(periods)
+st.line_chart(trend)
+
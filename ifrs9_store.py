@@ -0,0 +1,214 @@
+"""
+Local history of life insurers' IFRS 9 financial asset allocation, scraped
+from the insurance bureau's Info2-2.aspx disclosure pages.
+
+Each page shows the latest few reporting periods of one insurer. Rows are
+found by their 項目 label and every period column is kept, so polling the
+pages each quarter grows a long-format panel (公司, 期間, 類別, 金額) that the
+app charts from disk.
+"""
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import StringIO
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+import atomic_file
+import single_flight
+
+URL = 'https://ins-info.ib.gov.tw/customer/Info2-2.aspx?UID={}'
+TIMEOUT = 20  # seconds per page
+REFRESH_INTERVAL = 6 * 60 * 60  # seconds before the pages are polled again
+RETRY_INTERVAL = 5 * 60  # seconds before the pages that failed are fetched again
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'ifrs9')
+PANEL_PATH = os.path.join(CACHE_DIR, 'panel.pkl')
+FAILURES_PATH = os.path.join(CACHE_DIR, 'failures.json')  # {company: error} of the last fetch
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'ifrs9')
+
+# Company -> UID of the insurers scraped, extendable with IFRS9_INSURERS='{"三商美邦人壽": "..."}'.
+# A configured subset, not every life insurer: the list is not read from the regulator's site.
+INSURERS = {
+    '新光人壽': '03458902',
+    '國泰人壽': '03374707',
+    '南山人壽': '11456006',
+    '富邦人壽': '27935073',
+    '台灣人壽': '03557017',
+    '中國人壽': '03434016',
+    '全球人壽': '70817744',
+}
+INSURERS.update(json.loads(os.environ.get('IFRS9_INSURERS', '{}')))
+
+# Category -> 項目 label pattern; the first matching row is used
+ROW_LABELS = {
+    'FVPL_PLO': r'透過損益按公允價值衡量之金融資產',
+    'FVOCI': r'透過其他綜合損益按公允價值衡量之金融資產',
+    'AC': r'按攤銷後成本衡量之金融資產',
+    '總資產': r'^資產(?:總計|總額|合計)$',
+}
+ASSET_CLASSES = ['FVPL_PLO', 'FVOCI', 'AC']
+
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=16))
+
+def fetch_page(uid):
+    def fetch():
+        response = _session.get(URL.format(uid), timeout=TIMEOUT)
+        response.raise_for_status()
+        response.encoding = 'utf-8'
+        return response.text
+    return single_flight.do('ins-info', uid, fetch)
+
+def read_table(html):
+    """
+    Return the disclosure table of an Info2-2 page, its second table.
+    """
+    return pd.read_html(StringIO(html))[1]
+
+def fetch_table(uid):
+    return read_table(fetch_page(uid))
+
+def record_fixture(uid):
+    """
+    Save the live page of one insurer to fixtures/ifrs9 for the parser check.
+    """
+    html = fetch_page(uid)
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    with open(os.path.join(FIXTURE_DIR, f"{uid}.html"), 'w', encoding='utf-8') as f:
+        f.write(html)
+    return html
+
+def period_key(period):
+    """
+    Sort key of a period label such as '113年第2季': its numbers in order,
+    with Minguo years converted to Western years.
+    """
+    numbers = [int(n) for n in re.findall(r'\d+', str(period))]
+    if numbers and numbers[0] < 1000:
+        numbers[0] += 1911
+    return tuple(numbers)
+
+def parse_table(table):
+    """
+    Return the category x period amounts of one disclosure table. Period
+    columns are the columns after 項目 whose name contains a number. Raises
+    ValueError naming the categories whose row is not found.
+    """
+    labels = table['項目'].astype(str).str.replace(r'\s', '', regex=True)
+    start = table.columns.get_loc('項目') + 1
+    periods = [column for column in table.columns[start:] if re.search(r'\d', str(column))]
+
+    positions, missing = {}, []
+    for category, pattern in ROW_LABELS.items():
+        matches = labels.index[labels.str.contains(pattern)]
+        if len(matches):
+            positions[category] = table.index.get_loc(matches[0])
+        else:
+            missing.append(category)
+    if missing:
+        raise ValueError(f"rows not found: {', '.join(missing)}")
+    rows = table.iloc[list(positions.values())][periods]
+    amounts = rows.apply(lambda column: pd.to_numeric(column.astype(str).str.replace(',', ''), errors='coerce'))
+    amounts.index = list(positions)
+    return amounts.dropna(axis=1, how='all')
+
+def fetch_all(insurers=None, max_workers=8):
+    """
+    Fetch and parse every insurer's page concurrently. Returns (panel, errors):
+    the long-format rows of the pages that succeeded and {company: error} for
+    the others.
+    """
+    insurers = insurers or INSURERS
+    frames, errors = [], {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(insurers))) as executor:
+        futures = {executor.submit(fetch_table, uid): company for company, uid in insurers.items()}
+        for future in as_completed(futures):
+            company = futures[future]
+            try:
+                amounts = parse_table(future.result())
+            except Exception as e:
+                errors[company] = str(e)
+                continue
+            rows = amounts.rename_axis('類別').rename_axis(columns='期間').stack().rename('金額').reset_index()
+            frames.append(rows.assign(公司=company))
+    panel = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['公司', '期間', '類別', '金額'])
+    return panel[['公司', '期間', '類別', '金額']], errors
+
+def _write_failures(errors):
+    if errors:
+        def write(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(errors, f, ensure_ascii=False)
+        atomic_file.write(FAILURES_PATH, write)
+    elif os.path.exists(FAILURES_PATH):
+        os.remove(FAILURES_PATH)
+
+def load_panel(refresh=True, force=False):
+    """
+    Return (panel, errors). The stored panel is refreshed from the pages when
+    it is older than REFRESH_INTERVAL (or force is set): fetched
+    (公司, 期間) pairs replace the stored ones, so new periods are appended
+    and restated ones overwritten while older periods are kept. Insurers
+    whose page failed stay in errors and are fetched again on their own after
+    RETRY_INTERVAL.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    panel = pd.read_pickle(PANEL_PATH) if os.path.exists(PANEL_PATH) else None
+    refreshed_at = os.path.getmtime(PANEL_PATH) if panel is not None else None
+    failures, failed_at = {}, None
+    if os.path.exists(FAILURES_PATH):
+        with open(FAILURES_PATH, encoding='utf-8') as f:
+            failures = json.load(f)
+        failed_at = os.path.getmtime(FAILURES_PATH)
+
+    if force or refreshed_at is None or time.time() - refreshed_at > REFRESH_INTERVAL:
+        insurers = INSURERS
+    elif failures and time.time() - failed_at > RETRY_INTERVAL:
+        insurers = {company: uid for company, uid in INSURERS.items() if company in failures}
+    else:
+        insurers = None
+    if not refresh or not insurers:
+        return panel, failures
+
+    fetched, errors = fetch_all(insurers)
+    if not fetched.empty:
+        if panel is not None:
+            replaced = panel.set_index(['公司', '期間']).index.isin(fetched.set_index(['公司', '期間']).index)
+            panel = panel[~replaced]
+        panel = pd.concat([panel, fetched], ignore_index=True)
+        atomic_file.write(PANEL_PATH, panel.to_pickle)
+        if insurers is not INSURERS:
+            # A retry of the failed pages does not postpone the next full refresh
+            os.utime(PANEL_PATH, (refreshed_at, refreshed_at))
+    _write_failures(errors)
+    return panel, errors
+
+def allocation(panel):
+    """
+    Return the (公司, 期間) x category frame of each asset class's share of
+    total assets, plus 金融資產, the sum of the three classes.
+    """
+    amounts = panel.pivot_table(index=['公司', '期間'], columns='類別', values='金額', aggfunc='last')
+    amounts = amounts.reindex(columns=ASSET_CLASSES + ['總資產'])
+    ratios = amounts[ASSET_CLASSES].div(amounts['總資產'], axis=0)
+    ratios['總資產'] = 1.0
+    ratios['金融資產'] = ratios[ASSET_CLASSES].sum(axis=1, min_count=1)
+    ratios.columns.name = None
+    return ratios
+
+def industry_allocation(panel):
+    """
+    Return the period x asset class share of total assets summed over every
+    insurer that reported the period, in period order.
+    """
+    amounts = panel.pivot_table(index='期間', columns='類別', values='金額', aggfunc='sum')
+    ratios = amounts.reindex(columns=ASSET_CLASSES).div(amounts['總資產'], axis=0)
+    ratios.columns.name = None
+    return ratios.loc[sorted(ratios.index, key=period_key)]
+
+def periods(panel):
+    return sorted(panel['期間'].unique(), key=period_key)
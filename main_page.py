@@ -1,36 +1,158 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import pydeck as pdk
+import os
+import atomic_file
 
 st.title('Uber pickups in NYC')
 
 DATE_COLUMN = 'date/time'
 DATA_URL = ('https://s3-us-west-2.amazonaws.com/'
             'streamlit-demo-data/uber-raw-data-sep14.csv.gz')
+# Local columnar copy, sorted by hour of day
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'uber-raw-data-sep14.npz')
+RAW_ROWS = 10000  # rows shown by 'Show raw data'
+CELL_PIXELS = 8  # side of a density cell on screen
+RAW_POINT_ZOOM = 14  # raw pickups are drawn from this zoom level on
+MAX_RAW_POINTS = 20000
+VIEW_PIXELS = (700, 500)  # approximate map size, for the zoomed-in bounds
 
-@st.cache_data
-def load_data(nrows):
-    data = pd.read_csv(DATA_URL, nrows=nrows)
+def convert_data():
+    """
+    Download the full CSV once and save its columns sorted by hour, with the
+    row offset of every hour and the pickups-per-hour histogram.
+    """
+    data = pd.read_csv(DATA_URL)
     lowercase = lambda x: str(x).lower()
     data.rename(lowercase, axis='columns', inplace=True)
-    data[DATE_COLUMN] = pd.to_datetime(data[DATE_COLUMN])
-    return data
+    times = pd.to_datetime(data[DATE_COLUMN], format='%m/%d/%Y %H:%M:%S')
+
+    hours = times.dt.hour.to_numpy()
+    order = np.argsort(hours, kind='stable')
+    hist = np.bincount(hours, minlength=24)
+    base_codes, base_names = pd.factorize(data['base'])
+
+    def write(path):
+        # A file object, since np.savez would append .npz to the temporary name
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                time=times.to_numpy().astype('datetime64[s]')[order],
+                lat=data['lat'].to_numpy(dtype=float)[order],
+                lon=data['lon'].to_numpy(dtype=float)[order],
+                base=base_codes.astype(np.uint8)[order],
+                base_names=np.asarray(base_names, dtype=str),
+                offsets=np.r_[0, np.cumsum(hist)],
+                hist=hist,
+            )
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    atomic_file.write(CACHE_PATH, write)
+
+@st.cache_resource
+def load_data():
+    # Shared by every session without copying; treat the arrays as read-only
+    if not os.path.exists(CACHE_PATH):
+        convert_data()
+    with np.load(CACHE_PATH) as columns:
+        return {name: columns[name] for name in columns.files}
+
+def rows(data, start, stop):
+    return pd.DataFrame({
+        DATE_COLUMN: data['time'][start:stop],
+        'lat': data['lat'][start:stop],
+        'lon': data['lon'][start:stop],
+        'base': data['base_names'][data['base'][start:stop]],
+    })
+
+def view_bounds(lat, lon, zoom):
+    """
+    Approximate (lat_min, lat_max, lon_min, lon_max) visible around a center
+    at a web-mercator zoom level.
+    """
+    degrees_per_pixel = 360 / (256 * 2 ** zoom)
+    half_lon = degrees_per_pixel * VIEW_PIXELS[0] / 2
+    half_lat = degrees_per_pixel * VIEW_PIXELS[1] / 2 * np.cos(np.radians(lat))
+    return lat - half_lat, lat + half_lat, lon - half_lon, lon + half_lon
+
+@st.cache_data(max_entries=24 * 8)
+def bin_pickups(hour, zoom):
+    """
+    Count the pickups of one hour on a grid of CELL_PIXELS-wide cells at the
+    given zoom level. Returns one row per non-empty cell: center lat/lon and
+    count.
+    """
+    data = load_data()
+    start, stop = data['offsets'][hour], data['offsets'][hour + 1]
+    lat, lon = data['lat'][start:stop], data['lon'][start:stop]
+    if len(lat) == 0:
+        return pd.DataFrame({'lat': [], 'lon': [], 'count': []})
+
+    # Square on screen: latitude steps shrink with cos(latitude)
+    cell_lon = 360 / (256 * 2 ** zoom) * CELL_PIXELS
+    cell_lat = cell_lon * np.cos(np.radians(np.median(lat)))
+    lat0, lon0 = lat.min(), lon.min()
+    row = ((lat - lat0) // cell_lat).astype(np.int64)
+    col = ((lon - lon0) // cell_lon).astype(np.int64)
+
+    cells, counts = np.unique(row * (col.max() + 1) + col, return_counts=True)
+    return pd.DataFrame({
+        'lat': lat0 + (cells // (col.max() + 1) + 0.5) * cell_lat,
+        'lon': lon0 + (cells % (col.max() + 1) + 0.5) * cell_lon,
+        'count': counts,
+    })
+
+def create_map(data, hour, zoom):
+    """
+    Density layer of the binned pickups, or the raw pickups in view once
+    zoomed in far enough for them to be few. Raw pickups only cover the
+    view_bounds box around the median pickup, so the density layer is kept
+    for the cells outside it, which a panned map shows.
+    """
+    start, stop = data['offsets'][hour], data['offsets'][hour + 1]
+    lat, lon = float(np.median(data['lat'][start:stop])), float(np.median(data['lon'][start:stop]))
+    view = pdk.ViewState(latitude=lat, longitude=lon, zoom=zoom)
+
+    cells = bin_pickups(hour, zoom)
+    if zoom >= RAW_POINT_ZOOM:
+        lat_min, lat_max, lon_min, lon_max = view_bounds(lat, lon, zoom)
+        points = rows(data, start, stop)
+        points = points[points['lat'].between(lat_min, lat_max) & points['lon'].between(lon_min, lon_max)]
+        if len(points) <= MAX_RAW_POINTS:
+            outside = cells[~(cells['lat'].between(lat_min, lat_max) & cells['lon'].between(lon_min, lon_max))]
+            layers = [
+                pdk.Layer('HeatmapLayer', data=outside, get_position='[lon, lat]', get_weight='count',
+                          radius_pixels=CELL_PIXELS * 2, aggregation='SUM'),
+                pdk.Layer('ScatterplotLayer', data=points[['lat', 'lon']], get_position='[lon, lat]',
+                          get_radius=10, radius_min_pixels=2, get_fill_color=[255, 75, 75, 160]),
+            ]
+            return pdk.Deck(layers=layers, initial_view_state=view, map_style=None), len(points), 'points'
+
+    layer = pdk.Layer('HeatmapLayer', data=cells, get_position='[lon, lat]', get_weight='count',
+                      radius_pixels=CELL_PIXELS * 2, aggregation='SUM')
+    return pdk.Deck(layers=[layer], initial_view_state=view, map_style=None), len(cells), 'cells'
 
 data_load_state = st.text('Loading data...')
-data = load_data(10000)
-data_load_state.text("Done! (using st.cache_data)")
+data = load_data()
+data_load_state.text("Done! (using st.cache_resource)")
 
 if st.checkbox('Show raw data'):
     st.subheader('Raw data')
-    st.write(data)
+    st.caption(f"First {RAW_ROWS:,} of {len(data['time']):,} pickups, ordered by hour")
+    st.write(rows(data, 0, RAW_ROWS))
 
 st.subheader('Number of pickups by hour')
-hist_values = np.histogram(data[DATE_COLUMN].dt.hour, bins=24, range=(0,24))[0]
+hist_values = data['hist']
 st.bar_chart(hist_values)
 
 # Some number in the range 0-23
 hour_to_filter = st.slider('hour', 0, 23, 17)
-filtered_data = data[data[DATE_COLUMN].dt.hour == hour_to_filter]
+zoom = st.select_slider('zoom', options=list(range(10, 17)), value=11)
 
 st.subheader('Map of all pickups at %s:00' % hour_to_filter)
-st.map(filtered_data)
\ No newline at end of file
+deck, drawn, kind = create_map(data, hour_to_filter, zoom)
+st.pydeck_chart(deck)
+st.caption(f"{data['hist'][hour_to_filter]:,} pickups drawn as {drawn:,} {kind}")
+if kind == 'points':
+    st.caption("Raw pickups are drawn only in the initial view around the median pickup; "
+               "panning beyond it shows the density heatmap.")
@@ -1,13 +1,17 @@
 import streamlit as st
-import requests
-import io
+import mops_revenue
 import pandas as pd
 import numpy as np
-import plotly.express as px
+import plotly.graph_objects as go
+import treemap_agg
+import single_flight
 from datetime import datetime, timedelta
 
 st.title("Monthly Revenue Analysis")
 
+with st.sidebar.expander("上游請求統計"):
+    st.dataframe(single_flight.stats())
+
 # Get the current date and subtract one month
 today = datetime.today()
 first_day_of_this_month = today.replace(day=1)
@@ -20,23 +24,18 @@ default_month = previous_month_date.month
 # Input for year and month with default values
 year = st.slider("Select Year", 100, 121, default_year)
 month = st.slider("Select Month", 1, 12, default_month)
+markets = st.multiselect("Select Market", list(mops_revenue.MARKETS), default=['sii', 'otc'],
+                         format_func=mops_revenue.MARKETS.get)
+if not markets:
+    st.stop()
 
-def monthly_revenue(year, month):
-    url = "https://mops.twse.com.tw/server-java/FileDownLoad" 
-    payload = {
-        "step": "9",
-        "functionName": "show_file2",
-        "filePath": "/t21/sii/",
-        "fileName": f"t21sc03_{year}_{month}.csv"
-    }
-    response = requests.post(url, data=payload)
-    response.encoding = 'utf-8'
-    df = pd.read_csv(io.StringIO(response.text))
+def monthly_revenue(year, month, markets):
+    df = mops_revenue.load_markets(year, month, tuple(markets))
     
     # Data processing
     df['公司名稱'] = df['公司名稱'] + "<br>" + df['公司代號'].astype(str)
     df_filtered = df[df['營業收入-當月營收'] > 0]
-    df_filtered = df_filtered[['產業別','公司名稱','營業收入-當月營收','營業收入-上月營收','累計營業收入-當月累計營收','累計營業收入-去年累計營收']]
+    df_filtered = df_filtered[['市場別','產業別','公司名稱','營業收入-當月營收','營業收入-上月營收','累計營業收入-當月累計營收','累計營業收入-去年累計營收']]
     df_filtered['營業收入-當月營收'] = (df_filtered['營業收入-當月營收'] / 100000)
     df_filtered['營業收入-上月營收'] = df_filtered['營業收入-上月營收'] / 100000
     df_filtered['月營收增減'] = (df_filtered['營業收入-當月營收'] - df_filtered['營業收入-上月營收']) / df_filtered['營業收入-上月營收'].abs()
@@ -45,20 +44,33 @@ def monthly_revenue(year, month):
     df_filtered['累計營收增減'] = (df_filtered['累計營業收入-當月累計營收'] - df_filtered['累計營業收入-去年累計營收']) / df_filtered['累計營業收入-去年累計營收'].abs()
     return df_filtered
 
-df_filtered = monthly_revenue(year, month)
+try:
+    df_filtered = monthly_revenue(year, month, markets)
+except ValueError:
+    st.error(f"查無 {year} 年 {month} 月營收資料")
+    st.stop()
 
 # Create the treemap visualization
 limit = 0.5
 df_filtered['color'] = np.where(df_filtered['月營收增減'] > limit, limit, 
               np.where(df_filtered['月營收增減'] < -limit, -limit, df_filtered['月營收增減']))
-fig = px.treemap(df_filtered, 
-                 path=[px.Constant('月營收'),'產業別','公司名稱'],
-                 values='營業收入-當月營收',
-                 color='color',
-                 color_continuous_scale='RdYlBu_r',
-                 width=1200, height=700,
-                 color_continuous_midpoint=0,
-                 custom_data=['累計營收增減','累計營業收入-當月累計營收','累計營業收入-去年累計營收']) 
+# Build the hierarchy server-side, folding the smallest companies of each industry into one node
+max_companies = st.select_slider("Treemap 顯示公司數", options=[100, 200, 500, 1000, '全部'], value=500)
+nodes = treemap_agg.aggregate(df_filtered,
+                              path=(['市場別'] if len(markets) > 1 else []) + ['產業別','公司名稱'],
+                              values='營業收入-當月營收',
+                              color='color',
+                              root='月營收',
+                              custom_data=['累計營收增減','累計營業收入-當月累計營收','累計營業收入-去年累計營收'],
+                              sum_columns=['累計營業收入-當月累計營收','累計營業收入-去年累計營收'],
+                              max_leaves=None if max_companies == '全部' else max_companies)
+nodes['累計營收增減'] = (nodes['累計營業收入-當月累計營收'] - nodes['累計營業收入-去年累計營收']) / nodes['累計營業收入-去年累計營收'].abs()
+fig = go.Figure(go.Treemap(ids=nodes['id'], labels=nodes['label'], parents=nodes['parent'],
+                           values=nodes['value'], branchvalues='total',
+                           marker=dict(colors=nodes['color'], colorscale='RdYlBu_r', cmid=0,
+                                       showscale=True, colorbar=dict(title='color')),
+                           customdata=nodes[['累計營收增減','累計營業收入-當月累計營收','累計營業收入-去年累計營收']].to_numpy()),
+                layout=dict(width=1200, height=700))
 
 fig.update_layout(margin=dict(t=30, l=10, r=10, b=5))
 fig.update_traces(hovertemplate='當月營收(億)：%{value:.0f}<br>營收變動: %{color:.1%}<br>當年累計營收: %{customdata[1]:.0f}<br>累計營收變動: %{customdata[0]:.1%}')
@@ -68,3 +80,34 @@ fig.update_traces(textfont_size=16)
 # Display the Plotly treemap
 st.plotly_chart(fig)
 
+
+# Revenue history across all months since Minguo 100
+st.subheader("歷史營收趨勢")
+
+@st.cache_data(ttl=3600)
+def revenue_history(by, markets):
+    panel = pd.concat([mops_revenue.load_panel(market) for market in markets], ignore_index=True)
+    names = panel.groupby('公司代號')['公司名稱'].last()
+    return mops_revenue.revenue_metrics(mops_revenue.revenue_matrix(panel, by)), names
+
+if st.checkbox("載入歷史營收 (首次載入需下載所有月份)"):
+    by = st.radio("分析對象", ['公司代號', '產業別'], format_func=lambda x: '公司' if x == '公司代號' else '產業', horizontal=True)
+    with st.spinner("Loading revenue history..."):
+        metrics, names = revenue_history(by, tuple(markets))
+
+    keys = metrics['營收'].index.tolist()
+    label = (lambda key: f"{key} {names.get(key, '')}") if by == '公司代號' else str
+    key = st.selectbox("選擇公司/產業", keys, format_func=label)
+
+    history = pd.DataFrame({name: frame.loc[key] for name, frame in metrics.items()})
+    history.index = history.index.to_timestamp()
+    st.line_chart(history['營收'] / 100000)
+    st.bar_chart(history[['YoY', '3M動能']])
+
+    latest = metrics['營收'].columns[-1]
+    ranking = pd.DataFrame({name: frame[latest] for name, frame in metrics.items()})
+    if by == '公司代號':
+        ranking.insert(0, '公司名稱', names.reindex(ranking.index))
+    ranking = ranking.dropna(subset=['3M動能']).sort_values('3M動能', ascending=False)
+    st.write(f"{latest} 營收動能排行")
+    st.dataframe(ranking.style.format({'營收': '{:,.0f}', 'YoY': '{:.1%}', '3M動能': '{:.1%}'}))
@@ -0,0 +1,194 @@
+"""
+Download MOPS monthly revenue CSVs (t21sc03_{year}_{month}.csv) with an
+on-disk cache keyed by (market, year, month).
+
+Both the raw CSV bytes and the parsed frame are kept. Closed months never
+change, so they never expire; recent months are re-downloaded after a short
+TTL while companies are still filing.
+
+The months are also collected into a company x month revenue panel, which is
+backfilled once and then extended by fetching only new months.
+"""
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+import atomic_file
+import single_flight
+
+URL = "https://mops.twse.com.tw/server-java/FileDownLoad"
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'mops')
+OPEN_MONTH_TTL = 60 * 60  # seconds
+MARKETS = {'sii': '上市', 'otc': '上櫃', 'rotc': '興櫃'}
+
+# One keep-alive connection pool shared by every download
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+def is_closed(year, month, today=None):
+    """
+    Revenue for a month is filed by the 10th of the following month, so a
+    (Minguo year, month) is final once the following month has ended.
+    """
+    today = today or datetime.today()
+    return (today.year * 12 + today.month) - ((year + 1911) * 12 + month) >= 2
+
+def download_csv(year, month, market='sii'):
+    payload = {
+        "step": "9",
+        "functionName": "show_file2",
+        "filePath": f"/t21/{market}/",
+        "fileName": f"t21sc03_{year}_{month}.csv"
+    }
+    def fetch():
+        response = _session.post(URL, data=payload, timeout=30)
+        response.raise_for_status()
+        return response.content
+    return single_flight.do('mops', (market, year, month), fetch)
+
+def parse_csv(raw):
+    df = pd.read_csv(io.StringIO(raw.decode('utf-8', errors='replace')))
+    if '公司代號' not in df.columns:
+        raise ValueError("response is not a monthly revenue CSV")
+    return df
+
+def load_month(year, month, market='sii'):
+    """
+    Return the parsed revenue CSV of one (Minguo year, month), reading it from
+    the cache when possible. Raises ValueError if MOPS has no file yet.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    base = os.path.join(CACHE_DIR, f"{market}_{year}_{month}")
+    csv_path, frame_path = base + '.csv', base + '.pkl'
+
+    if os.path.exists(frame_path):
+        age = time.time() - os.path.getmtime(frame_path)
+        if is_closed(year, month) or age < OPEN_MONTH_TTL:
+            return pd.read_pickle(frame_path)
+
+    raw = download_csv(year, month, market)
+    df = parse_csv(raw)
+
+    def write_raw(path):
+        with open(path, 'wb') as f:
+            f.write(raw)
+    atomic_file.write(csv_path, write_raw)
+    atomic_file.write(frame_path, df.to_pickle)
+    return df
+
+def load_markets(year, month, markets=('sii', 'otc')):
+    """
+    Download the revenue CSVs of several markets concurrently and merge them
+    into one frame with a 市場別 column. Markets without a file are skipped;
+    raises ValueError if none has one.
+    """
+    def fetch(market):
+        try:
+            return load_month(year, month, market).assign(市場別=MARKETS[market])
+        except ValueError:
+            return None
+    with ThreadPoolExecutor(max_workers=len(markets)) as executor:
+        frames = [df for df in executor.map(fetch, markets) if df is not None]
+    if not frames:
+        raise ValueError(f"no revenue file for {year}/{month}")
+    return pd.concat(frames, ignore_index=True)
+
+def available_months(start_year=100, today=None):
+    """
+    Return every (Minguo year, month) from January of start_year through the
+    latest month that can have been filed.
+    """
+    today = today or datetime.today()
+    last = pd.Period(year=today.year, month=today.month, freq='M') - 1
+    periods = pd.period_range(pd.Period(year=start_year + 1911, month=1, freq='M'), last, freq='M')
+    return [(period.year - 1911, period.month) for period in periods]
+
+def _panel_rows(year, month, market):
+    df = load_month(year, month, market)
+    return pd.DataFrame({
+        'month': pd.Period(year=year + 1911, month=month, freq='M'),
+        '公司代號': df['公司代號'].astype(str),
+        '公司名稱': df['公司名稱'],
+        '產業別': df['產業別'],
+        '營收': pd.to_numeric(df['營業收入-當月營收'], errors='coerce'),
+    })
+
+def load_panel(market='sii', start_year=100, max_workers=4):
+    """
+    Return the long-format revenue panel (month, 公司代號, 公司名稱, 產業別, 營收)
+    for every available month since start_year. Only months missing from the
+    saved panel, plus months that are not closed yet, are downloaded, using
+    at most max_workers concurrent requests.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    panel_path = os.path.join(CACHE_DIR, f"panel_{market}.pkl")
+    panel = pd.read_pickle(panel_path) if os.path.exists(panel_path) else None
+
+    have = set() if panel is None else set(panel['month'].unique())
+    wanted = [
+        (year, month) for year, month in available_months(start_year)
+        if pd.Period(year=year + 1911, month=month, freq='M') not in have or not is_closed(year, month)
+    ]
+    if not wanted:
+        return panel
+
+    def fetch(year_month):
+        try:
+            return _panel_rows(*year_month, market)
+        except ValueError:
+            return None  # not published yet
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        new_rows = [rows for rows in executor.map(fetch, wanted) if rows is not None]
+
+    if new_rows:
+        fetched = pd.concat(new_rows, ignore_index=True)
+        if panel is not None:
+            panel = panel[~panel['month'].isin(fetched['month'].unique())]
+        panel = pd.concat([panel, fetched], ignore_index=True).sort_values(['month', '公司代號'], ignore_index=True)
+        atomic_file.write(panel_path, panel.to_pickle)
+    return panel
+
+def revenue_matrix(panel, by='公司代號'):
+    """
+    Pivot the panel into a key x month revenue matrix. by='產業別' sums the
+    companies of each industry.
+    """
+    matrix = panel.pivot_table(index=by, columns='month', values='營收', aggfunc='sum', dropna=False)
+    full_range = pd.period_range(panel['month'].min(), panel['month'].max(), freq='M')
+    return matrix.reindex(columns=full_range)
+
+def revenue_metrics(matrix):
+    """
+    Compute YoY growth, 3-month momentum (last three months against the same
+    three months a year earlier) and the streak of consecutive months with
+    positive YoY for every row and month of a revenue matrix at once.
+    """
+    values = matrix.to_numpy(dtype=float)
+    last_year = np.full_like(values, np.nan)
+    last_year[:, 12:] = values[:, :-12]
+
+    rolling = np.full_like(values, np.nan)
+    rolling[:, 2:] = values[:, 2:] + values[:, 1:-1] + values[:, :-2]
+    rolling_last_year = np.full_like(values, np.nan)
+    rolling_last_year[:, 12:] = rolling[:, :-12]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        yoy = values / last_year - 1
+        momentum = rolling / rolling_last_year - 1
+    yoy[~np.isfinite(yoy)] = np.nan
+    momentum[~np.isfinite(momentum)] = np.nan
+
+    growing = yoy > 0
+    count = np.cumsum(growing, axis=1)
+    streak = count - np.maximum.accumulate(np.where(growing, 0, count), axis=1)
+
+    def frame(data):
+        return pd.DataFrame(data, index=matrix.index, columns=matrix.columns)
+    return {'營收': matrix, 'YoY': frame(yoy), '3M動能': frame(momentum), '連續成長月數': frame(streak)}
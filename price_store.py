@@ -0,0 +1,271 @@
+"""
+Local SQLite store of daily yfinance history shared by the apps in this repo.
+
+Bars, dividends and splits are kept per symbol together with the date range
+already downloaded, so a request only fetches the missing part of the range
+and appends it instead of re-downloading the full history.
+"""
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pandas as pd
+import yfinance as yf
+
+import single_flight
+
+DB_PATH = os.environ.get(
+    'PRICE_STORE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'prices.sqlite'),
+)
+REFRESH_INTERVAL = 15 * 60  # seconds before today's bar is downloaded again
+EMPTY_RETRY_INTERVAL = 24 * 60 * 60  # seconds before a past range that returned no bars is asked for again
+DEFAULT_YEARS = 20
+
+PRICE_COLUMNS = {
+    'Open': 'open',
+    'High': 'high',
+    'Low': 'low',
+    'Close': 'close',
+    'Adj Close': 'adj_close',
+    'Volume': 'volume',
+}
+ACTION_COLUMNS = {
+    'Dividends': 'dividends',
+    'Stock Splits': 'stock_splits',
+}
+
+_lock = threading.Lock()
+
+@contextmanager
+def _connect():
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        with conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS prices (
+                    symbol TEXT, date TEXT, open REAL, high REAL, low REAL,
+                    close REAL, adj_close REAL, volume REAL,
+                    PRIMARY KEY (symbol, date)
+                );
+                CREATE TABLE IF NOT EXISTS actions (
+                    symbol TEXT, date TEXT, dividends REAL, stock_splits REAL,
+                    PRIMARY KEY (symbol, date)
+                );
+                CREATE TABLE IF NOT EXISTS coverage (
+                    symbol TEXT PRIMARY KEY, start TEXT, end TEXT, checked_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS empty_checks (
+                    symbol TEXT PRIMARY KEY, start TEXT, end TEXT, checked_at REAL
+                );
+                """
+            )
+            yield conn
+    finally:
+        conn.close()
+
+def _to_date(value, default):
+    if value is None:
+        return default
+    return pd.Timestamp(value).strftime('%Y-%m-%d')
+
+def _date_range(start, end):
+    today = datetime.now()
+    start = _to_date(start, (today - timedelta(days=365 * DEFAULT_YEARS)).strftime('%Y-%m-%d'))
+    end = _to_date(end, (today + timedelta(days=1)).strftime('%Y-%m-%d'))
+    return start, end
+
+def _download_one(symbol, start, end):
+    history = yf.Ticker(symbol).history(start=start, end=end, auto_adjust=False, actions=True)
+    if history.index.tz is not None:
+        history.index = history.index.tz_localize(None)
+    return history
+
+def _download(symbols, start, end, max_workers):
+    """
+    Download [start, end) for all symbols in one batched request, retrying the
+    symbols missing from the batch on a bounded thread pool. A symbol in the
+    batch without bars gets an empty frame. yfinance reports a range without
+    bars (a weekend) and a failed ticker the same way, so an empty frame does
+    not confirm the range.
+    """
+    frames = {}
+    if len(symbols) > 1:
+        try:
+            data = yf.download(symbols, start=start, end=end, auto_adjust=False, actions=True,
+                               group_by='ticker', progress=False)
+            for symbol in symbols:
+                if symbol in data.columns.get_level_values(0):
+                    frames[symbol] = data[symbol].dropna(subset=['Close'])
+        except Exception:
+            pass
+
+    missing = [symbol for symbol in symbols if symbol not in frames]
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as executor:
+            futures = {executor.submit(_download_one, symbol, start, end): symbol for symbol in missing}
+            for future in as_completed(futures):
+                try:
+                    frames[futures[future]] = future.result()
+                except Exception:
+                    pass
+    return frames
+
+def _write(conn, symbol, frame, start, end, replace=False):
+    if replace:
+        conn.execute('DELETE FROM prices WHERE symbol = ?', (symbol,))
+        conn.execute('DELETE FROM actions WHERE symbol = ?', (symbol,))
+    dates = frame.index.strftime('%Y-%m-%d')
+    bars = frame.reindex(columns=list(PRICE_COLUMNS)).dropna(subset=['Close'])
+    conn.executemany(
+        'INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        [(symbol, date, *row) for date, row in zip(bars.index.strftime('%Y-%m-%d'), bars.itertuples(index=False))],
+    )
+    actions = frame.reindex(columns=list(ACTION_COLUMNS)).fillna(0)
+    has_action = (actions != 0).any(axis=1).to_numpy()
+    conn.executemany(
+        'INSERT OR REPLACE INTO actions VALUES (?, ?, ?, ?)',
+        [(symbol, date, *row) for date, row in zip(dates[has_action], actions[has_action].itertuples(index=False))],
+    )
+
+    # Today's bar is still forming, so coverage never extends past today.
+    end = min(end, datetime.now().strftime('%Y-%m-%d'))
+    row = conn.execute('SELECT start, end FROM coverage WHERE symbol = ?', (symbol,)).fetchone()
+    if row is not None and not replace:
+        start, end = min(start, row[0]), max(end, row[1])
+    conn.execute('INSERT OR REPLACE INTO coverage VALUES (?, ?, ?, ?)', (symbol, start, end, time.time()))
+    conn.execute('DELETE FROM empty_checks WHERE symbol = ?', (symbol,))
+
+def _recently_empty(empty_checks, symbol, start, end, today):
+    """
+    Whether [start, end) of symbol came back without bars recently enough
+    not to be asked for again yet.
+    """
+    if symbol not in empty_checks:
+        return False
+    checked_start, checked_end, checked_at = empty_checks[symbol]
+    interval = REFRESH_INTERVAL if end > today else EMPTY_RETRY_INTERVAL
+    return checked_start <= start and end <= checked_end and time.time() - checked_at < interval
+
+def update(symbols, start=None, end=None, max_workers=8):
+    """
+    Make sure [start, end) is on disk for every symbol, downloading only the
+    date ranges not fetched before. Symbols that need the same range are
+    downloaded together in one batch. Concurrent updates of the same symbols
+    and range share one download.
+    """
+    symbols = list(dict.fromkeys(symbols))
+    start, end = _date_range(start, end)
+    single_flight.do('yfinance', (tuple(symbols), start, end), lambda: _update(symbols, start, end, max_workers))
+
+def _update(symbols, start, end, max_workers):
+    today = datetime.now().strftime('%Y-%m-%d')
+    end = min(end, (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d'))
+
+    with _connect() as conn:
+        coverage = {row[0]: row[1:] for row in conn.execute('SELECT * FROM coverage')}
+        empty_checks = {row[0]: row[1:] for row in conn.execute('SELECT * FROM empty_checks')}
+
+    jobs = {}
+    for symbol in dict.fromkeys(symbols):
+        if symbol not in coverage:
+            windows = [(start, end)]
+        else:
+            covered_start, covered_end, checked_at = coverage[symbol]
+            windows = []
+            if start < covered_start:
+                windows.append((start, covered_start))
+            recently_checked = covered_end >= today and time.time() - checked_at < REFRESH_INTERVAL
+            if end > covered_end and not recently_checked:
+                windows.append((covered_end, end))
+        for window in windows:
+            if not _recently_empty(empty_checks, symbol, *window, today):
+                jobs.setdefault(window, []).append(symbol)
+
+    for (fetch_start, fetch_end), group in jobs.items():
+        frames = _download(group, fetch_start, fetch_end, max_workers)
+        restated = []
+        with _lock, _connect() as conn:
+            for symbol, frame in frames.items():
+                if frame.empty:
+                    # Not confirmed: coverage stays put and the range is asked for again later
+                    conn.execute('INSERT OR REPLACE INTO empty_checks VALUES (?, ?, ?, ?)',
+                                 (symbol, fetch_start, fetch_end, time.time()))
+                    continue
+                # A new dividend or split restates Adj Close for all earlier bars.
+                appended = symbol in coverage and fetch_start >= coverage[symbol][1]
+                actions = frame.reindex(columns=list(ACTION_COLUMNS)).fillna(0)
+                action_dates = set(frame.index[(actions != 0).any(axis=1).to_numpy()].strftime('%Y-%m-%d'))
+                known_dates = {row[0] for row in conn.execute('SELECT date FROM actions WHERE symbol = ?', (symbol,))}
+                if appended and action_dates - known_dates:
+                    restated.append(symbol)
+                else:
+                    _write(conn, symbol, frame, fetch_start, fetch_end)
+        for symbol in restated:
+            full_start = min(start, coverage[symbol][0])
+            frame = _download([symbol], full_start, fetch_end, max_workers).get(symbol)
+            if frame is not None and not frame.empty:
+                with _lock, _connect() as conn:
+                    _write(conn, symbol, frame, full_start, fetch_end, replace=True)
+
+def load_history(symbol, start=None, end=None, refresh=True):
+    """
+    Return daily OHLCV bars for [start, end) indexed by date, in the same
+    layout as yf.download.
+    """
+    if refresh:
+        update([symbol], start, end)
+    start, end = _date_range(start, end)
+    with _connect() as conn:
+        data = pd.read_sql_query(
+            'SELECT * FROM prices WHERE symbol = ? AND date >= ? AND date < ? ORDER BY date',
+            conn, params=(symbol, start, end),
+        )
+    data.index = pd.DatetimeIndex(pd.to_datetime(data.pop('date')), name='Date')
+    data = data.drop(columns='symbol').rename(columns={v: k for k, v in PRICE_COLUMNS.items()})
+    return data
+
+def load_dividends(symbol, start=None, end=None, refresh=True):
+    """
+    Return the cash dividends paid in [start, end) indexed by ex-dividend date.
+    """
+    if refresh:
+        update([symbol], start, end)
+    start, end = _date_range(start, end)
+    with _connect() as conn:
+        data = pd.read_sql_query(
+            'SELECT date, dividends FROM actions '
+            'WHERE symbol = ? AND date >= ? AND date < ? AND dividends != 0 ORDER BY date',
+            conn, params=(symbol, start, end),
+        )
+    return pd.Series(data['dividends'].to_numpy(), index=pd.DatetimeIndex(pd.to_datetime(data['date']), name='Date'),
+                     name='Dividends')
+
+def load_prices(symbols, start=None, end=None, field='Adj Close', max_workers=8):
+    """
+    Return one price field for several symbols as a date x symbol frame,
+    together with the symbols that have no data in the range.
+    """
+    symbols = list(dict.fromkeys(symbols))
+    update(symbols, start, end, max_workers=max_workers)
+    start, end = _date_range(start, end)
+    column = PRICE_COLUMNS[field]
+    placeholders = ', '.join('?' * len(symbols))
+    with _connect() as conn:
+        data = pd.read_sql_query(
+            f'SELECT symbol, date, {column} FROM prices '
+            f'WHERE symbol IN ({placeholders}) AND date >= ? AND date < ?',
+            conn, params=(*symbols, start, end),
+        )
+    prices = data.pivot(index='date', columns='symbol', values=column).reindex(columns=symbols)
+    prices.index = pd.DatetimeIndex(pd.to_datetime(prices.index), name='Date')
+    prices.columns.name = None
+    failed = [symbol for symbol in symbols if prices[symbol].dropna().empty]
+    return prices, failed
@@ -0,0 +1,72 @@
+"""
+Single-flight coordination of upstream fetches shared by the apps in this repo.
+
+Streamlit runs every session as a thread of one process, so when several
+users load the same symbol at once each session would call Yahoo, MOPS,
+ins-info or Chrome for the same data. do() lets the first caller of a
+(source, key) fetch while later callers of the same key wait for it and share
+its result, or its exception. Counters of issued and coalesced calls per
+source show the effect.
+"""
+import threading
+from collections import Counter
+
+import pandas as pd
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+_lock = threading.Lock()
+_in_flight = {}
+_counters = {}
+
+def do(source, key, fetch):
+    """
+    Return fetch() for (source, key). If the same call is already in flight,
+    wait for it instead and return its result, or raise its exception.
+    key must be hashable and should include the requested range; results are
+    shared between callers, so treat them as read-only.
+    """
+    with _lock:
+        counter = _counters.setdefault(source, Counter())
+        call = _in_flight.get((source, key))
+        leader = call is None
+        if leader:
+            call = _in_flight[(source, key)] = _Call()
+            counter['issued'] += 1
+        else:
+            counter['coalesced'] += 1
+
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = fetch()
+        return call.result
+    except BaseException as e:
+        call.error = e
+        with _lock:
+            counter['failed'] += 1
+        raise
+    finally:
+        with _lock:
+            del _in_flight[(source, key)]
+        call.done.set()
+
+def stats():
+    """
+    Return one row per source with the issued, coalesced and failed call
+    counts since the process started, and the share of calls coalesced.
+    """
+    with _lock:
+        rows = {source: dict(counter) for source, counter in _counters.items()}
+    table = pd.DataFrame.from_dict(rows, orient='index').reindex(columns=['issued', 'coalesced', 'failed'])
+    table = table.fillna(0).astype(int)
+    table['coalesced %'] = (table['coalesced'] / (table['issued'] + table['coalesced']) * 100).round(1)
+    return table.sort_index()
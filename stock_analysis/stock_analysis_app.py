@@ -1,10 +1,13 @@
-import yfinance as yf
-import quantstats as qs
 import streamlit as st
 import datetime
 import warnings
-import pandas as pd
-import base64
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import price_store
+import tearsheet
+import single_flight
 
 # Suppress warnings
 warnings.filterwarnings("ignore")
@@ -15,6 +18,9 @@ st.set_page_config(layout="wide")
 # Streamlit App title
 st.title("Stock Performance Analysis with QuantStats")
 
+with st.sidebar.expander("Upstream request stats"):
+    st.dataframe(single_flight.stats())
+
 # Input for stock symbol and benchmark
 stock_symbol = st.text_input("Enter the stock symbol (e.g., 0050.TW)", "0050.TW")
 benchmark_symbol = st.text_input("Enter the benchmark symbol (e.g., ^TWII for Taiwan Index)", "^TWII")
@@ -22,15 +28,22 @@ benchmark_symbol = st.text_input("Enter the benchmark symbol (e.g., ^TWII for Ta
 # Input for number of years
 years = st.number_input("Enter the number of years of historical data", min_value=1, max_value=20, value=10)
 
-def get_binary_file_downloader_html(bin_file, file_label='File'):
-    with open(bin_file, 'rb') as f:
-        data = f.read()
-    bin_str = base64.b64encode(data).decode()
-    href = f'<a href="data:application/octet-stream;base64,{bin_str}" download="{file_label}">Download {file_label}</a>'
-    return href
+# Fast Plotly report, the full QuantStats tearsheet or full tearsheets for a symbol list
+mode = st.radio("Report mode", ["Fast", "Full QuantStats", "Batch"], horizontal=True)
+if mode == "Batch":
+    tearsheet.show_batch(benchmark_symbol, years)
+    st.stop()
 
-# Button to trigger the report generation
+# Button to trigger the report generation; a fast report stays up while its sections are toggled,
+# until one of the inputs changes
+request = (stock_symbol, benchmark_symbol, years, mode)
 if st.button('Generate Report'):
+    st.session_state.report_request = request
+    show_report = True
+else:
+    show_report = mode == "Fast" and st.session_state.get('report_request') == request
+
+if show_report:
     # Calculate the start and end dates based on the specified number of years
     end_date = datetime.datetime.today().strftime("%Y-%m-%d")
     start_date = (datetime.datetime.today() - datetime.timedelta(days=365 * years)).strftime("%Y-%m-%d")
@@ -39,29 +52,21 @@ if st.button('Generate Report'):
     if stock_symbol and benchmark_symbol:
         st.write(f"Fetching data for {stock_symbol} from {start_date} to {end_date}...")
         try:
-            # Disable progress bar in yfinance
-            #yf.pdr_override()
-            data = yf.download(stock_symbol, start=start_date, end=end_date, progress=False)
-            benchmark_data = yf.download(benchmark_symbol, start=start_date, end=end_date, progress=False)
+            data = price_store.load_history(stock_symbol, start_date, end_date)
+            benchmark_data = price_store.load_history(benchmark_symbol, start_date, end_date)
                                          
             if not data.empty:
-                # Calculate the daily returns
-                returns = data["Adj Close"].pct_change().dropna()
-                benchmark_returns = benchmark_data["Adj Close"].pct_change().dropna() 
-                # Generate QuantStats report
-                st.write(f"Generating report for {stock_symbol}...")
-                # Save the QuantStats report to an HTML file
-                report_file = f"{stock_symbol}_quantstats_report.html"
-                #qs.reports.html(returns, benchmark=benchmark_returns, output=report_file, title=f"{stock_symbol} 績效報告" ,benchmark_title=f"{benchmark_symbol}")
-                qs.reports.html(returns, 
-                benchmark=benchmark_returns, 
-                output=report_file, 
-                title=f"{stock_symbol} 績效報告", 
-                benchmark_title=f"{benchmark_symbol}")
-                # Provide download link
-                st.markdown(get_binary_file_downloader_html(report_file, f'{stock_symbol}_report.html'), unsafe_allow_html=True)
+                if mode == "Fast":
+                    tearsheet.show_fast_report(stock_symbol, benchmark_symbol, data, benchmark_data)
+                else:
+                    # Generate QuantStats report
+                    st.write(f"Generating report for {stock_symbol}...")
+                    report_html = tearsheet.report(stock_symbol, benchmark_symbol, years, data, benchmark_data)
+                    # Provide download button
+                    st.download_button(label=f"Download {stock_symbol}_report.html", data=report_html,
+                                       file_name=f"{stock_symbol}_report.html", mime="text/html")
                 
-                st.success("Report generated successfully. Click the link above to download.")
+                    st.success("Report generated successfully. Click the button above to download.")
             else:
                 st.write(f"No data found for {stock_symbol}. Please check the symbol and try again.")
         except Exception as e:
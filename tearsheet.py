@@ -0,0 +1,353 @@
+"""
+QuantStats tearsheets rendered in memory and cached across sessions.
+
+qs.reports.html can only write to a file, so every report is written to its
+own temporary directory and read back, which keeps concurrent users from
+overwriting each other's report. It draws its charts on matplotlib's global
+pyplot state, so renders within one process take a lock and run one at a
+time. Finished reports are cached by (symbol, benchmark, years, last data
+date), so the same request within a trading day is served without
+regenerating it.
+
+The fast report computes the core QuantStats metrics with NumPy and draws
+them with Plotly instead, in well under a second. Batch mode renders full
+reports for a list of symbols on a process pool and zips them as they
+finish.
+"""
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+import weakref
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import quantstats as qs
+import streamlit as st
+
+import price_store
+
+MAX_REPORTS = 32  # cached reports, least recently used evicted first
+ARCHIVE_MAX_AGE = 24 * 60 * 60  # seconds before a batch ZIP left behind by a dead server is deleted
+TRADING_DAYS = 252
+ROLLING_WINDOWS = {'6M': 126, '12M': 252}
+
+_render_lock = threading.Lock()
+
+def render(returns, benchmark_returns, title, benchmark_title):
+    """
+    Return the HTML of a QuantStats tearsheet as a string.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir, _render_lock:
+        report_file = os.path.join(tmp_dir, 'quantstats-tearsheet.html')
+        qs.reports.html(
+            returns,
+            benchmark=benchmark_returns,
+            output=report_file,
+            title=title,
+            benchmark_title=benchmark_title
+        )
+        with open(report_file, "r", encoding="utf-8") as file:
+            return file.read()
+
+@st.cache_data(max_entries=MAX_REPORTS, show_spinner=False)
+def _cached_report(symbol, benchmark_symbol, years, last_date, _data, _benchmark_data):
+    returns = _data["Adj Close"].pct_change().dropna()
+    benchmark_returns = _benchmark_data["Adj Close"].pct_change().dropna()
+    return render(returns, benchmark_returns, f"{symbol} 績效報告", f"{benchmark_symbol}")
+
+def report(symbol, benchmark_symbol, years, data, benchmark_data):
+    """
+    Return the tearsheet HTML of symbol against benchmark_symbol from their
+    price_store histories, reusing a cached report when neither history has
+    a newer bar.
+    """
+    last_date = max(frame.index[-1] for frame in (data, benchmark_data) if not frame.empty).strftime('%Y-%m-%d')
+    return _cached_report(symbol, benchmark_symbol, years, last_date, data, benchmark_data)
+
+def align_returns(data, benchmark_data):
+    """
+    Return the daily returns of both histories on their common dates as a
+    date x [Strategy, Benchmark] frame.
+    """
+    prices = pd.concat([data["Adj Close"], benchmark_data["Adj Close"]], axis=1, keys=['Strategy', 'Benchmark'])
+    return prices.dropna().pct_change().iloc[1:]
+
+def metrics(returns):
+    """
+    Compute the core QuantStats metrics for every column of a date x series
+    returns frame at once (rf = 0, compounded).
+    """
+    r = returns.to_numpy(dtype=float)
+    n = len(r)
+    wealth = np.cumprod(1 + r, axis=0)
+    years = n / TRADING_DAYS
+
+    mean = r.mean(axis=0)
+    std = r.std(axis=0, ddof=1)
+    downside = np.sqrt((np.minimum(r, 0) ** 2).sum(axis=0) / n)
+    drawdown = wealth / np.maximum.accumulate(np.maximum(wealth, 1), axis=0) - 1
+    max_drawdown = drawdown.min(axis=0)
+    cagr = wealth[-1] ** (1 / years) - 1
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        table = {
+            'Cumulative Return': wealth[-1] - 1,
+            'CAGR': cagr,
+            'Volatility (ann.)': std * np.sqrt(TRADING_DAYS),
+            'Sharpe': mean / std * np.sqrt(TRADING_DAYS),
+            'Sortino': mean / downside * np.sqrt(TRADING_DAYS),
+            'Max Drawdown': max_drawdown,
+            'Calmar': cagr / np.abs(max_drawdown),
+            'Best Day': r.max(axis=0),
+            'Worst Day': r.min(axis=0),
+            'Win Rate': (r > 0).sum(axis=0) / (r != 0).sum(axis=0),
+        }
+    if 'Benchmark' in returns.columns:
+        x = r[:, list(returns.columns).index('Benchmark')]
+        beta = ((r - mean) * (x - x.mean())[:, None]).sum(axis=0) / ((x - x.mean()) ** 2).sum()
+        table['Beta'] = beta
+        table['Alpha (ann.)'] = (mean - beta * x.mean()) * TRADING_DAYS
+        table['Correlation'] = np.corrcoef(r.T)[list(returns.columns).index('Benchmark')]
+    return pd.DataFrame(table, index=returns.columns).T
+
+def drawdowns(returns):
+    """
+    Return the underwater curve of a returns series.
+    """
+    wealth = np.cumprod(1 + returns.to_numpy(dtype=float))
+    return pd.Series(wealth / np.maximum.accumulate(np.maximum(wealth, 1)) - 1, index=returns.index)
+
+def drawdown_periods(underwater, top=5):
+    """
+    Return the `top` deepest drawdown periods with their start, valley, end,
+    depth and length in days.
+    """
+    in_drawdown = underwater.to_numpy() < 0
+    if not in_drawdown.any():
+        return pd.DataFrame(columns=['Start', 'Valley', 'End', 'Max Drawdown', 'Days'])
+    starts = in_drawdown & ~np.r_[False, in_drawdown[:-1]]
+    period = np.cumsum(starts)[in_drawdown]
+    dates = underwater.index[in_drawdown]
+    depth = underwater.to_numpy()[in_drawdown]
+
+    first = np.flatnonzero(np.r_[True, period[1:] != period[:-1]])
+    last = np.r_[first[1:], len(period)] - 1
+    valley = np.minimum.reduceat(depth, first)
+    valley_pos = np.lexsort((depth, period))[first]
+
+    # As in QuantStats, a period ends on its last bar below the peak
+    table = pd.DataFrame({
+        'Start': dates[first].date,
+        'Valley': dates[valley_pos].date,
+        'End': dates[last].date,
+        'Max Drawdown': valley,
+        'Days': (dates[last] - dates[first]).days + 1,
+    })
+    return table.nsmallest(top, 'Max Drawdown').reset_index(drop=True)
+
+def monthly_returns(returns):
+    """
+    Return the compounded return of every month as a year x month frame.
+    """
+    index = returns.index
+    months = (index.year - index.year.min()) * 12 + index.month - 1
+    log_sum = np.bincount(months, weights=np.log1p(returns.to_numpy(dtype=float)), minlength=months.max() + 1)
+    traded = np.bincount(months, minlength=months.max() + 1) > 0
+    values = np.where(traded, np.expm1(log_sum), np.nan)
+    values = np.pad(values, (0, -len(values) % 12), constant_values=np.nan).reshape(-1, 12)
+    return pd.DataFrame(values, index=range(index.year.min(), index.year.min() + len(values)),
+                        columns=['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'])
+
+def rolling_beta(returns, benchmark_returns, window):
+    """
+    Rolling beta of returns against benchmark_returns over `window` bars,
+    from running sums instead of one regression per window. All NaN when
+    the history is shorter than the window.
+    """
+    y = returns.to_numpy(dtype=float)
+    x = benchmark_returns.to_numpy(dtype=float)
+    if len(y) < window:
+        return pd.Series(np.nan, index=returns.index)
+
+    def window_sum(values):
+        total = np.r_[0, np.cumsum(values)]
+        return total[window:] - total[:-window]
+    sx, sy = window_sum(x), window_sum(y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beta = (window_sum(x * y) - sx * sy / window) / (window_sum(x * x) - sx * sx / window)
+    return pd.Series(np.r_[np.full(window - 1, np.nan), beta], index=returns.index)
+
+def show_fast_report(symbol, benchmark_symbol, data, benchmark_data):
+    """
+    Render the fast report: key metrics and cumulative returns at once, the
+    heavier sections only when their toggle is switched on.
+    """
+    returns = align_returns(data, benchmark_data)
+    if len(returns) < 2:
+        st.write(f"Not enough overlapping data for {symbol} and {benchmark_symbol}.")
+        return
+    names = {'Strategy': symbol, 'Benchmark': benchmark_symbol}
+    table = metrics(returns)
+
+    columns = st.columns(4)
+    for column, name in zip(columns, ['CAGR', 'Sharpe', 'Sortino', 'Max Drawdown']):
+        value = table.loc[name, 'Strategy']
+        benchmark_value = table.loc[name, 'Benchmark']
+        percent = name in ('CAGR', 'Max Drawdown')
+        column.metric(name, f"{value:.2%}" if percent else f"{value:.2f}",
+                      f"{value - benchmark_value:+.2%}" if percent else f"{value - benchmark_value:+.2f}")
+
+    percent_rows = ['Cumulative Return', 'CAGR', 'Volatility (ann.)', 'Max Drawdown', 'Best Day', 'Worst Day',
+                    'Win Rate', 'Alpha (ann.)']
+    percent = pd.IndexSlice[[name for name in percent_rows if name in table.index], :]
+    ratio = pd.IndexSlice[[name for name in table.index if name not in percent_rows], :]
+    st.dataframe(table.rename(columns=names).style.format('{:.2%}', subset=percent).format('{:.2f}', subset=ratio),
+                 use_container_width=True)
+
+    cumulative = (1 + returns).cumprod() - 1
+    fig = px.line(cumulative.rename(columns=names), labels={'value': 'Cumulative Return', 'variable': ''})
+    fig.update_layout(yaxis_tickformat='.0%', hovermode='x unified', margin=dict(t=20, l=25, r=20, b=20))
+    st.plotly_chart(fig, use_container_width=True)
+
+    if st.toggle("Drawdowns"):
+        underwater = drawdowns(returns['Strategy'])
+        fig = go.Figure(go.Scatter(x=underwater.index, y=underwater, fill='tozeroy', line_color='crimson', name=symbol))
+        fig.update_layout(yaxis_tickformat='.0%', margin=dict(t=20, l=25, r=20, b=20))
+        st.plotly_chart(fig, use_container_width=True)
+        periods = drawdown_periods(underwater)
+        st.dataframe(periods.style.format({'Max Drawdown': '{:.2%}'}), use_container_width=True)
+
+    if st.toggle("Monthly Returns"):
+        monthly = monthly_returns(returns['Strategy'])
+        limit = np.nanmax(np.abs(monthly.to_numpy()))
+        fig = px.imshow(monthly * 100, text_auto='.1f', aspect='auto', color_continuous_scale='RdYlGn',
+                        zmin=-limit * 100, zmax=limit * 100, labels={'color': '%'})
+        fig.update_yaxes(type='category', autorange='reversed')
+        fig.update_layout(margin=dict(t=20, l=25, r=20, b=20))
+        st.plotly_chart(fig, use_container_width=True)
+
+    if st.toggle("Rolling Beta"):
+        betas = pd.DataFrame({label: rolling_beta(returns['Strategy'], returns['Benchmark'], window)
+                              for label, window in ROLLING_WINDOWS.items()})
+        fig = px.line(betas, labels={'value': f'Beta to {benchmark_symbol}', 'variable': 'Window'})
+        fig.update_layout(hovermode='x unified', margin=dict(t=20, l=25, r=20, b=20))
+        st.plotly_chart(fig, use_container_width=True)
+
+def batch_report(symbol, benchmark_symbol, start_date, end_date):
+    """
+    Render the full tearsheet of one symbol from the price store. Runs in a
+    worker process; raises if the symbol has no data.
+    """
+    data = price_store.load_history(symbol, start_date, end_date, refresh=False)
+    benchmark_data = price_store.load_history(benchmark_symbol, start_date, end_date, refresh=False)
+    if data.empty:
+        raise ValueError('no price data')
+    returns = data["Adj Close"].pct_change().dropna()
+    benchmark_returns = benchmark_data["Adj Close"].pct_change().dropna()
+    return render(returns, benchmark_returns, f"{symbol} 績效報告", f"{benchmark_symbol}")
+
+def batch(symbols, benchmark_symbol, years, max_workers=4):
+    """
+    Render the tearsheets of many symbols on a process pool and yield
+    (symbol, html, error) as each one finishes. Prices are brought up to
+    date in one batched update first, so the workers only read the store.
+    """
+    end_date = datetime.today().strftime("%Y-%m-%d")
+    start_date = (datetime.today() - timedelta(days=365 * years)).strftime("%Y-%m-%d")
+    symbols = list(dict.fromkeys(symbols))
+    price_store.update(symbols + [benchmark_symbol], start_date, end_date)
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        futures = {
+            executor.submit(batch_report, symbol, benchmark_symbol, start_date, end_date): symbol
+            for symbol in symbols
+        }
+        for future in as_completed(futures):
+            symbol = futures[future]
+            try:
+                yield symbol, future.result(), None
+            except Exception as e:
+                yield symbol, None, str(e)
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+class BatchArchive:
+    """
+    Temporary ZIP file of one batch, deleted with the object: when the
+    session that keeps it in session_state ends, when a new batch replaces
+    it, or when the server exits.
+    """
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(prefix='tearsheets_', suffix='.zip')
+        os.close(fd)
+        self._finalizer = weakref.finalize(self, _remove, self.path)
+
+    def remove(self):
+        self._finalizer()
+
+def prune_archives(max_age=ARCHIVE_MAX_AGE):
+    """
+    Delete batch ZIPs older than max_age that no session removed, e.g.
+    after the server was killed.
+    """
+    cutoff = time.time() - max_age
+    pattern = re.compile(r'tearsheets_.*\.zip$')
+    for entry in os.scandir(tempfile.gettempdir()):
+        if pattern.match(entry.name) and entry.stat().st_mtime < cutoff:
+            _remove(entry.path)
+
+def show_batch(benchmark_symbol, years, max_workers=4):
+    """
+    Render batch mode: a symbol list, a progress bar while the reports are
+    generated and a ZIP download of the finished reports.
+    """
+    text = st.text_area("Symbols (separated by commas, spaces or new lines)", "0050.TW\n0056.TW\n00878.TW")
+    symbols = list(dict.fromkeys(re.findall(r'[^\s,;]+', text)))
+
+    if st.button(f'Generate {len(symbols)} Reports', disabled=not symbols):
+        # A new batch replaces the previous archive
+        previous = st.session_state.pop('batch_reports', None)
+        if previous is not None:
+            previous[1].remove()
+        prune_archives()
+
+        progress = st.progress(0.0, text=f"Generating reports against {benchmark_symbol}...")
+        errors = {}
+        # Reports are compressed into an archive on disk as they arrive; only its handle is kept in the session
+        batch_archive = BatchArchive()
+        try:
+            with zipfile.ZipFile(batch_archive.path, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for done, (symbol, report_html, error) in enumerate(batch(symbols, benchmark_symbol, years, max_workers), 1):
+                    if error is None:
+                        archive.writestr(f"{symbol}_performance_report.html", report_html)
+                    else:
+                        errors[symbol] = error
+                    progress.progress(done / len(symbols), text=f"{done}/{len(symbols)} done ({symbol})")
+        except BaseException:
+            batch_archive.remove()
+            raise
+        st.session_state.batch_reports = (f"tearsheets_{datetime.today():%Y%m%d}.zip", batch_archive, errors)
+
+    if 'batch_reports' in st.session_state:
+        file_name, batch_archive, errors = st.session_state.batch_reports
+        if os.path.exists(batch_archive.path):
+            with open(batch_archive.path, 'rb') as archive:
+                st.download_button(label="Download Reports (ZIP)", data=archive, file_name=file_name,
+                                   mime="application/zip")
+        if errors:
+            with st.expander(f"{len(errors)} symbols failed"):
+                for symbol, error in errors.items():
+                    st.write(f"{symbol}: {error}")
@@ -1,5 +1,6 @@
 import streamlit as st
-import yfinance as yf
+import price_store
+import dividend_strategy
 import pandas as pd
 from datetime import datetime, timedelta
 import pytz
@@ -9,13 +10,17 @@ def get_stock_data(symbol, start_date, end_date, max_retries=5, retry_delay=5):
     """
     Fetch stock data with retry mechanism
     """
+    tz = pytz.timezone('Asia/Taipei')
     for attempt in range(max_retries):
         try:
-            stock = yf.Ticker(symbol)
-            data = stock.history(start=start_date, end=end_date)
-            dividends = stock.dividends
+            # Ticker.history's default Close is dividend-adjusted, i.e. the store's Adj Close
+            data = price_store.load_history(symbol, start_date, end_date)
+            data['Close'] = data['Adj Close']
+            data.index = data.index.tz_localize(tz)
+            dividends = price_store.load_dividends(symbol, start_date, end_date)
+            dividends.index = dividends.index.tz_localize(tz)
             if not data.empty and not dividends.empty:
-                return stock, data, dividends
+                return data, dividends
         except Exception as e:
             st.warning(f"Attempt {attempt + 1} failed: {str(e)}")
             if attempt < max_retries - 1:
@@ -23,8 +28,8 @@ def get_stock_data(symbol, start_date, end_date, max_retries=5, retry_delay=5):
                 time.sleep(retry_delay)
             else:
                 st.error("Failed to fetch data after multiple attempts.")
-                return None, None, None
-    return None, None, None
+                return None, None
+    return None, None
 
 def analyze_dividend_strategy(symbol, before_days, after_days, dividend_tax_rate, years=10):
     """
@@ -34,43 +39,19 @@ def analyze_dividend_strategy(symbol, before_days, after_days, dividend_tax_rate
     end_date = datetime.now(tz)
     start_date = end_date - timedelta(days=365*years)
     
-    stock, data, dividends = get_stock_data(symbol, start_date, end_date)
-    if stock is None or data is None or dividends is None:
+    data, dividends = get_stock_data(symbol, start_date, end_date)
+    if data is None or dividends is None:
         return None, 0, []
     
-    ex_dividend_dates = dividends.index.tz_convert(tz).tolist()
-    ex_dividend_dates = [date for date in ex_dividend_dates if date >= start_date]
-    
-    transaction_fee_rate = 0.001425 * 0.28
-    transaction_tax_rate = 0.001
-    
-    returns = []
+    ex_dividend_dates = dividends.index.tz_convert(tz)
+    events = dividends[ex_dividend_dates >= start_date]
     
-    for ex_div_date in ex_dividend_dates:
-        buy_date = ex_div_date - timedelta(days=before_days)
-        sell_date = ex_div_date + timedelta(days=after_days)
-        
-        buy_dates = data.index[data.index <= buy_date]
-        sell_dates = data.index[data.index >= sell_date]
-        
-        if len(buy_dates) == 0 or len(sell_dates) == 0:
-            continue
-        
-        buy_date = buy_dates[-1]
-        sell_date = sell_dates[0]
-        
-        buy_price = data.loc[buy_date, 'Close']
-        sell_price = data.loc[sell_date, 'Close']
-        
-        buy_cost = buy_price * (1 + transaction_fee_rate)
-        sell_proceeds = sell_price * (1 - transaction_fee_rate - transaction_tax_rate)
-        
-        dividend_amount = dividends.loc[ex_div_date]
-        after_tax_dividend = dividend_amount * (1 - dividend_tax_rate)
-        
-        total_return = (sell_proceeds - buy_cost + after_tax_dividend) / buy_cost
-        
-        returns.append((ex_div_date, total_return))
+    valid, total_returns = dividend_strategy.event_returns(
+        data.index.asi8, data['Close'].to_numpy(),
+        events.index.asi8, events.to_numpy(),
+        before_days, after_days, dividend_tax_rate,
+    )
+    returns = list(zip(events.index.tz_convert(tz)[valid], total_returns[valid]))
     
     if not returns:
         return None, 0, []
@@ -0,0 +1,46 @@
+"""
+Premium bookkeeping of etf_snapshots: a premium the feed shows as '-' is
+stored as NULL and does not break a deviation streak.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import etf_snapshots
+
+def snapshot(data_time, premiums):
+    return pd.DataFrame({
+        '資料時間': data_time,
+        'ETF代號': list(premiums),
+        '交易所': 'TSE',
+        '預估折溢價幅度': list(premiums.values()),
+        'ETF市值': 100.0,
+    })
+
+class PremiumTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        patcher = mock.patch.object(etf_snapshots, 'DB_PATH', os.path.join(self.tmp_dir, 'etf_nav.sqlite'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def test_missing_premium_is_null_and_keeps_the_streak(self):
+        premiums = [1.5, 1.6, np.nan, 1.4]
+        for minute, premium in enumerate(premiums):
+            etf_snapshots.append(snapshot(f'2024/06/03 10:0{minute}:00', {'0050': premium, '0056': 0.1}))
+
+        path = etf_snapshots.intraday('2024-06-03')
+        self.assertTrue(np.isnan(path['0050'].iloc[2]))
+        streaks = etf_snapshots.deviation_streaks(path, threshold=1.0)
+        self.assertEqual(streaks.loc['0050', '連續偏離次數'], len(premiums))
+        self.assertEqual(streaks.loc['0050', '偏離方向'], '溢價')
+        self.assertEqual(streaks.loc['0056', '連續偏離次數'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
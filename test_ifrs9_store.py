@@ -0,0 +1,46 @@
+"""
+Parser check of ifrs9_store against the Info2-2 pages in fixtures/ifrs9:
+every page must yield the four category rows for every period column.
+"""
+import glob
+import os
+import unittest
+
+import numpy as np
+
+import ifrs9_store
+
+FIXTURES = sorted(glob.glob(os.path.join(ifrs9_store.FIXTURE_DIR, '*.html')))
+
+class ParseTableTest(unittest.TestCase):
+    def test_fixtures_exist(self):
+        self.assertTrue(FIXTURES)
+
+    def test_parse_fixtures(self):
+        for path in FIXTURES:
+            with self.subTest(fixture=os.path.basename(path)):
+                with open(path, encoding='utf-8') as f:
+                    table = ifrs9_store.read_table(f.read())
+                amounts = ifrs9_store.parse_table(table)
+
+                self.assertEqual(list(amounts.index), list(ifrs9_store.ROW_LABELS))
+                periods = list(table.columns[table.columns.get_loc('項目') + 1:])
+                self.assertEqual(list(amounts.columns), periods)
+                self.assertEqual(sorted(periods, key=ifrs9_store.period_key, reverse=True), periods)
+
+                values = amounts.to_numpy(dtype=float)
+                self.assertFalse(np.isnan(values).any())
+                # Each class is a part of total assets, and so is their sum
+                self.assertTrue((values[:3] > 0).all())
+                self.assertTrue((values[:3].sum(axis=0) < values[3]).all())
+
+    def test_total_assets_is_not_a_subtotal(self):
+        path = os.path.join(ifrs9_store.FIXTURE_DIR, 'layout.html')
+        with open(path, encoding='utf-8') as f:
+            table = ifrs9_store.read_table(f.read())
+        amounts = ifrs9_store.parse_table(table)
+        # The row the original app read by position
+        self.assertEqual(amounts.loc['總資產'].tolist(), table.iloc[20, 3:].tolist())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""
+Coverage bookkeeping of price_store._update with yfinance patched: a ticker
+that fails inside a batch download must not be marked as checked.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import price_store
+
+def bars(dates):
+    close = np.linspace(100, 110, len(dates))
+    return pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close, 'Adj Close': close,
+                         'Volume': 1000.0, 'Dividends': 0.0, 'Stock Splits': 0.0}, index=dates)
+
+class UpdateCoverageTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        patcher = mock.patch.object(price_store, 'DB_PATH', os.path.join(self.tmp_dir, 'prices.sqlite'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+        self.today = datetime.now().strftime('%Y-%m-%d')
+        self.end = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+        self.start = (datetime.now() - timedelta(days=60)).strftime('%Y-%m-%d')
+        self.dates = pd.bdate_range(self.start, self.today)
+        self.failed = set()
+        self.calls = []
+
+    def download(self, symbols, start, end, **kwargs):
+        """
+        yf.download in group_by='ticker' layout; a failed ticker keeps its
+        columns but has no values, as yfinance returns it.
+        """
+        self.calls.append((tuple(symbols), start, end))
+        dates = self.dates[(self.dates >= start) & (self.dates < end)]
+        frames = {symbol: bars(dates) * (np.nan if symbol in self.failed else 1) for symbol in symbols}
+        return pd.concat(frames, axis=1)
+
+    def ticker(self, symbol):
+        """
+        yf.Ticker whose history returns an empty frame on failure instead of
+        raising, as yfinance does.
+        """
+        def history(start, end, **kwargs):
+            self.calls.append(((symbol,), start, end))
+            dates = self.dates[(self.dates >= start) & (self.dates < end)]
+            return bars(dates).iloc[:0 if symbol in self.failed else None]
+        return mock.Mock(history=history)
+
+    def coverage(self, symbol):
+        with price_store._connect() as conn:
+            return conn.execute('SELECT start, end FROM coverage WHERE symbol = ?', (symbol,)).fetchone()
+
+    def last_bar(self, symbol):
+        with price_store._connect() as conn:
+            return conn.execute('SELECT MAX(date) FROM prices WHERE symbol = ?', (symbol,)).fetchone()[0]
+
+    def test_failed_batch_symbol_keeps_coverage_and_is_retried(self):
+        with mock.patch.object(price_store.yf, 'download', side_effect=self.download), \
+                mock.patch.object(price_store.yf, 'Ticker', side_effect=self.ticker):
+            # Initial load up to ten business days ago
+            cutoff = self.dates[-10].strftime('%Y-%m-%d')
+            price_store._update(['A.TW', 'B.TW'], self.start, cutoff, max_workers=2)
+            self.assertEqual(self.coverage('B.TW'), (self.start, cutoff))
+
+            # B fails inside the batch that extends both to today
+            self.failed = {'B.TW'}
+            price_store._update(['A.TW', 'B.TW'], self.start, self.end, max_workers=2)
+            self.assertEqual(self.coverage('A.TW')[1], self.today)
+            self.assertEqual(self.coverage('B.TW'), (self.start, cutoff))
+            self.assertLess(self.last_bar('B.TW'), cutoff)
+
+            # Within the retry interval the unconfirmed range is not asked for again
+            self.calls.clear()
+            price_store._update(['A.TW', 'B.TW'], self.start, self.end, max_workers=2)
+            self.assertEqual(self.calls, [])
+
+            # Once it expires, B is retried from its old coverage end and the gap is filled
+            self.failed = set()
+            with mock.patch.object(price_store, 'REFRESH_INTERVAL', 0):
+                price_store._update(['A.TW', 'B.TW'], self.start, self.end, max_workers=2)
+            self.assertIn((('B.TW',), cutoff, self.end), self.calls)
+            self.assertEqual(self.coverage('B.TW')[1], self.today)
+            self.assertEqual(self.last_bar('B.TW'), self.dates[-1].strftime('%Y-%m-%d'))
+
+if __name__ == '__main__':
+    unittest.main()
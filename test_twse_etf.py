@@ -0,0 +1,68 @@
+"""
+Offline check of the JSON feed source against fixtures/etf_nav: the raw
+table feed_to_frame builds and the ETF_data frame load_data('fixture')
+returns from it.
+"""
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import etf_nav
+import etf_snapshots
+import twse_etf
+
+class FeedToFrameTest(unittest.TestCase):
+    def test_raw_table_layout(self):
+        feed = twse_etf.fetch_feed('TSE', source='fixture')
+        frame = twse_etf.feed_to_frame(feed)
+        self.assertEqual(list(frame.columns), ['分類', 'ETF代號/名稱', *twse_etf.FIELDS.values(), '資料時間'])
+        self.assertEqual(len(frame), sum(len(group['msgArray']) for group in feed['a1']))
+        self.assertTrue(all(isinstance(value, str) for value in frame.to_numpy().ravel()))
+        self.assertTrue(frame['ETF代號/名稱'].str.match(r'^\w+/.+').all())
+        self.assertTrue(pd.to_datetime(frame['資料時間'], format='%Y/%m/%d %H:%M:%S').notna().all())
+
+    def test_empty_feed(self):
+        self.assertTrue(twse_etf.feed_to_frame({}).empty)
+
+class LoadDataTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.data = etf_nav.load_data('fixture')
+
+    def test_columns(self):
+        expected = {'分類', '交易所', 'ETF代號', 'ETF名稱', 'yf_ticker', 'ETF市值', '資產類型', '資料時間',
+                    *etf_nav.COLUMN_SCHEMA}
+        self.assertEqual(set(self.data.columns), expected)
+        # Every column the snapshot store keeps
+        self.assertLessEqual(set(etf_snapshots.COLUMNS.values()), set(self.data.columns))
+
+    def test_dtypes(self):
+        for column in [*etf_nav.COLUMN_SCHEMA, 'ETF市值']:
+            with self.subTest(column=column):
+                self.assertEqual(self.data[column].dtype, np.float64)
+        for column in etf_nav.CATEGORICAL_COLUMNS:
+            with self.subTest(column=column):
+                self.assertIsInstance(self.data[column].dtype, pd.CategoricalDtype)
+
+    def test_values(self):
+        data = self.data
+        self.assertEqual(set(data['交易所']), set(twse_etf.FEEDS) & {'TSE'})
+        self.assertTrue((data['yf_ticker'] == data['ETF代號'] + '.TW').all())
+        self.assertTrue(data['ETF代號'].str.fullmatch(r'\d{4,5}[A-Z]?').all())
+        self.assertTrue(set(data['資產類型']) <= set(etf_nav.ASSET_TYPES.values()) | {'台幣股票型'})
+        self.assertTrue(data['成交價'].gt(0).all())
+        np.testing.assert_allclose(data['ETF市值'], (data['已發行受益權單位數'] * data['成交價'] / 1e8).round(2))
+
+class ParseColumnsTest(unittest.TestCase):
+    def test_placeholders_are_missing(self):
+        raw = pd.DataFrame({'成交價': ['1,234.50', '-'], '預估折溢價幅度': ['-0.12%', '-'],
+                            '前一營業日單位淨值': ['未結出', '20.10']})
+        parsed = etf_nav.parse_columns(raw)
+        self.assertEqual(parsed['成交價'].tolist()[0], 1234.5)
+        self.assertEqual(parsed['預估折溢價幅度'].tolist()[0], -0.12)
+        self.assertTrue(np.isnan(parsed['預估折溢價幅度'].tolist()[1]))
+        self.assertTrue(np.isnan(parsed['前一營業日單位淨值'].tolist()[0]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+"""
+Server-side treemap hierarchy for the Plotly treemaps in this repo.
+
+Instead of handing one leaf per company/ETF to px.treemap, the hierarchy is
+built here as flat ids/parents arrays. Only the largest leaves of each group
+are kept and the rest are folded into one "others" node per group, so the
+figure sent to the browser stays within a size budget.
+"""
+import numpy as np
+import pandas as pd
+
+SEPARATOR = '/'
+
+def aggregate(df, path, values, color, root, custom_data=(), sum_columns=(),
+              top_n=None, max_leaves=None, others_label='其他'):
+    """
+    Return one row per treemap node with columns id, parent, label, value,
+    color and the custom_data columns.
+
+    path lists the group columns followed by the leaf column. A leaf is kept if
+    it is among the top_n largest of its group and the max_leaves largest
+    overall; the others of each group are folded into one node. Node colors
+    are value-weighted means of their leaves, as px.treemap computes them;
+    leaves without a color are left out of the mean.
+    Columns in sum_columns are summed for folded and parent nodes; the leaf
+    column takes the node label there and other custom_data columns are left
+    empty.
+    """
+    groups, leaf = list(path[:-1]), path[-1]
+    custom_data = list(custom_data)
+    sum_columns = [column for column in sum_columns if column not in (values, color)]
+
+    df = df.sort_values(values, ascending=False, kind='stable')
+    df = df.assign(_weighted=df[values] * df[color], _colored=df[values].where(df[color].notna()))
+    keep = np.ones(len(df), dtype=bool)
+    if top_n is not None:
+        keep &= df.groupby(groups, sort=False, observed=True).cumcount().to_numpy() < top_n
+    if max_leaves is not None:
+        keep &= np.arange(len(df)) < max_leaves
+
+    sums = {values: (values, 'sum'), '_weighted': ('_weighted', 'sum'), '_colored': ('_colored', 'sum')}
+    sums.update({column: (column, 'sum') for column in sum_columns})
+
+    leaves = df.loc[keep, list(dict.fromkeys(groups + [leaf, values, '_weighted', '_colored'] + custom_data + sum_columns))]
+    folded = df.loc[~keep]
+    if not folded.empty:
+        others = folded.groupby(groups, sort=False, observed=True).agg(_count=(values, 'size'), **sums).reset_index()
+        others[leaf] = others_label + ' (' + others.pop('_count').astype(str) + ')'
+        leaves = pd.concat([leaves, others], ignore_index=True)
+
+    def ids(frame, columns):
+        node_ids = pd.Series(root, index=frame.index)
+        for column in columns:
+            node_ids = node_ids + SEPARATOR + frame[column].astype(str)
+        return node_ids
+
+    levels = [leaves.assign(id=ids(leaves, groups + [leaf]), parent=ids(leaves, groups), label=leaves[leaf].astype(str))]
+    for depth in range(len(groups), 0, -1):
+        level = leaves.groupby(groups[:depth], sort=False, observed=True).agg(**sums).reset_index()
+        levels.append(level.assign(id=ids(level, groups[:depth]), parent=ids(level, groups[:depth - 1]),
+                                   label=level[groups[depth - 1]].astype(str)))
+    top = {column: [leaves[column].sum()] for column in [values, '_weighted', '_colored'] + sum_columns}
+    levels.append(pd.DataFrame(top).assign(id=root, parent='', label=root))
+
+    nodes = pd.concat(levels, ignore_index=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nodes['color'] = nodes['_weighted'] / nodes['_colored']
+    nodes['value'] = nodes[values]
+    if leaf in custom_data:
+        nodes[leaf] = nodes[leaf].fillna(nodes['label'])
+    return nodes[['id', 'parent', 'label', 'value', 'color'] + custom_data]
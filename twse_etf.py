@@ -0,0 +1,95 @@
+"""
+Browser-free source for the mis.twse.com.tw ETF NAV disclosure data.
+
+The disclosure pages fill their tables from a JSON feed. Reading the feed
+directly over a pooled HTTP session returns the same rows as the Selenium
+scraper in etf_nav.py, in the same raw table layout, without starting Chrome.
+Feeds can be recorded to fixtures/etf_nav and replayed offline.
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+import single_flight
+
+# Exchange label -> JSON feed, overridable with ETF_NAV_FEEDS='{"OTC": "https://..."}'
+FEEDS = {
+    'TSE': 'https://mis.twse.com.tw/stock/data/all_etf.txt',
+}
+FEEDS.update(json.loads(os.environ.get('ETF_NAV_FEEDS', '{}')))
+REFERER = 'https://mis.twse.com.tw/stock/various-areas/etf-price/indicator-disclosure-etf?lang=zhHant'
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'etf_nav')
+
+# Feed field -> disclosure table column
+FIELDS = {
+    'c': '已發行受益權單位數',
+    'd': '與前日已發行受益單位差異數',
+    'e': '成交價',
+    'f': '投信或總代理人預估淨值',
+    'g': '預估折溢價幅度',
+    'h': '前一營業日單位淨值',
+}
+
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=8))
+_session.headers.update({'Referer': REFERER})
+
+def fixture_path(exchange):
+    return os.path.join(FIXTURE_DIR, f"{exchange}.json")
+
+def fetch_feed(exchange, source='api'):
+    """
+    Return the feed payload of one exchange, from the network (source='api')
+    or from its recorded fixture (source='fixture').
+    """
+    if source == 'fixture':
+        with open(fixture_path(exchange), encoding='utf-8') as f:
+            return json.load(f)
+    def fetch():
+        response = _session.get(FEEDS[exchange], timeout=10)
+        response.raise_for_status()
+        return response.json()
+    return single_flight.do('twse-etf', exchange, fetch)
+
+def record_fixture(exchange):
+    """
+    Save the live feed of one exchange as its fixture for offline runs.
+    """
+    feed = fetch_feed(exchange)
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    with open(fixture_path(exchange), 'w', encoding='utf-8') as f:
+        json.dump(feed, f, ensure_ascii=False, indent=1)
+    return feed
+
+def feed_to_frame(feed):
+    """
+    Convert a feed payload to the raw table layout scrape_etf_data returns:
+    one string column per disclosure table column.
+    """
+    items = [item for group in feed.get('a1', []) for item in group.get('msgArray', [])]
+    if not items:
+        return pd.DataFrame()
+    df = pd.DataFrame(items).fillna('').astype(str)
+    frame = pd.DataFrame({
+        '分類': '未分類',
+        'ETF代號/名稱': df['a'].str.strip() + '/' + df['b'].str.strip(),
+    })
+    for field, column in FIELDS.items():
+        frame[column] = df[field].str.strip().replace('', '-')
+    frame['資料時間'] = df['i'].str.replace(r'(\d{4})(\d{2})(\d{2})', r'\1/\2/\3', regex=True) + ' ' + df['j']
+    return frame
+
+def load_frames(source='api', exchanges=None):
+    """
+    Fetch the feeds of several exchanges concurrently and return
+    {exchange: raw table}.
+    """
+    exchanges = list(exchanges or FEEDS)
+    def load(exchange):
+        return feed_to_frame(fetch_feed(exchange, source))
+    with ThreadPoolExecutor(max_workers=len(exchanges)) as executor:
+        return dict(zip(exchanges, executor.map(load, exchanges)))